@@ -0,0 +1,85 @@
+"""
+Dashboard numbers for an admin, computed with aggregate queries.
+
+``get_stats`` runs a fixed number of GROUP BY/COUNT queries no matter how
+many quizzes or games the admin has, and keeps the result for a short while.
+Code that changes an admin's quizzes, questions or games calls ``invalidate``;
+the time limit bounds staleness for writes made by other workers and for
+players joining games.
+"""
+
+import time
+
+from sqlalchemy import func
+
+from models import db, Quiz, Question, GameSession, Participant
+
+RECENT_ACTIVITY_LIMIT = 10
+
+# admin_id -> (expires_at, stats dict)
+_cache = {}
+
+
+def question_counts(admin_id):
+    """Each of an admin's quizzes with its number of questions, in one query"""
+    return db.session.query(
+        Quiz.quiz_id, Quiz.title, Quiz.description, Quiz.created_at,
+        func.count(Question.question_id).label('question_count')
+    ).outerjoin(Question, Question.quiz_id == Quiz.quiz_id).filter(
+        Quiz.admin_id == admin_id
+    ).group_by(Quiz.quiz_id).order_by(Quiz.quiz_id).all()
+
+
+def compute_stats(admin_id):
+    total_quizzes, total_questions = db.session.query(
+        func.count(func.distinct(Quiz.quiz_id)), func.count(Question.question_id)
+    ).select_from(Quiz).outerjoin(Question, Question.quiz_id == Quiz.quiz_id).filter(
+        Quiz.admin_id == admin_id
+    ).one()
+
+    total_games, total_participants = db.session.query(
+        func.count(func.distinct(GameSession.game_session_id)), func.count(Participant.participant_id)
+    ).select_from(GameSession).outerjoin(
+        Participant, Participant.game_session_id == GameSession.game_session_id
+    ).filter(GameSession.admin_id == admin_id).one()
+
+    # Newest quizzes and newest games of those quizzes; the top few of each
+    # is all the merged list can ever need
+    quizzes_created = db.session.query(Quiz.title, Quiz.created_at).filter(
+        Quiz.admin_id == admin_id
+    ).order_by(Quiz.created_at.desc()).limit(RECENT_ACTIVITY_LIMIT).all()
+    games_hosted = db.session.query(Quiz.title, GameSession.started_at).join(
+        GameSession, GameSession.quiz_id == Quiz.quiz_id
+    ).filter(
+        Quiz.admin_id == admin_id, GameSession.started_at.isnot(None)
+    ).order_by(GameSession.started_at.desc()).limit(RECENT_ACTIVITY_LIMIT).all()
+
+    recent_activity = [(created_at, title, 'Quiz Created') for title, created_at in quizzes_created]
+    recent_activity += [(started_at, title, 'Game Hosted') for title, started_at in games_hosted]
+    recent_activity.sort(key=lambda item: item[0], reverse=True)
+
+    return {
+        'total_quizzes': total_quizzes,
+        'total_questions': total_questions,
+        'total_games': total_games,
+        'total_participants': total_participants,
+        'recent_activity': [{
+            'title': title,
+            'type': kind,
+            'date': timestamp.strftime('%Y-%m-%d %H:%M')
+        } for timestamp, title, kind in recent_activity[:RECENT_ACTIVITY_LIMIT]]
+    }
+
+
+def get_stats(admin_id, ttl):
+    cached = _cache.get(admin_id)
+    now = time.monotonic()
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    stats = compute_stats(admin_id)
+    _cache[admin_id] = (now + ttl, stats)
+    return stats
+
+
+def invalidate(admin_id):
+    _cache.pop(admin_id, None)
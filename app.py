@@ -1,14 +1,31 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_file, stream_with_context
 from flask_socketio import SocketIO, emit, join_room, leave_room
-from models import db, Admin, Quiz, Question, Answer, GameSession, Participant, ParticipantAnswer
-from werkzeug.security import generate_password_hash, check_password_hash
-import random
-import string
+from models import db, Admin, Quiz, Question, Answer, GameSession, Participant, ParticipantAnswer, GameCheckpoint, ImportJob, configure_sqlite, add_missing_columns, create_missing_indexes, game_codes_reusable
+from message_queue import LocalSocketManager
+import game_state
+import quiz_cache
+import admin_stats
+import quiz_io
+import metrics
+import socket_json
+from write_behind import MicroBatcher, SingleWriter, update_game_session, write_answers, write_participants
+from worker_bus import WorkerBus
+from tally import TallyAggregator
+from scheduler import QuestionScheduler
+from sqlalchemy import delete, select
+from passwords import HashingBusy, PasswordHasher
+from game_codes import GameCodeAllocator
+from checkpoint import Checkpointer
+from ratelimit import Admission, RateLimiter, busy, limit_socketio
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone
+import atexit
 import json
+import codecs
 import csv
 import io
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -23,20 +40,311 @@ if DATABASE_URL and DATABASE_URL.startswith('postgres://'):
 
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL or 'sqlite:///database.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# SQLite allows one writer at a time: socket handlers then write through a single task per process
+app.config['SQLITE_SINGLE_WRITER'] = (
+    app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') and os.environ.get('SQLITE_SINGLE_WRITER', '1') != '0'
+)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+# How long (seconds) submitted answers are buffered before being written together
+app.config['ANSWER_FLUSH_INTERVAL'] = float(os.environ.get('ANSWER_FLUSH_INTERVAL', 0.05))
+# How long (seconds) joining players are buffered before being inserted together
+app.config['JOIN_FLUSH_INTERVAL'] = float(os.environ.get('JOIN_FLUSH_INTERVAL', 0.05))
+# How many entries every player sees at the top of a server-driven leaderboard
+app.config['LEADERBOARD_TOP_N'] = int(os.environ.get('LEADERBOARD_TOP_N', 10))
+# How often (seconds) the host screen receives updated answer counts
+app.config['TALLY_INTERVAL'] = float(os.environ.get('TALLY_INTERVAL', 0.2))
+# Extra seconds after a question's time limit during which answers still count
+app.config['ANSWER_GRACE_PERIOD'] = float(os.environ.get('ANSWER_GRACE_PERIOD', 0.5))
+# How long (seconds) dashboard stats may be served from cache
+app.config['ADMIN_STATS_TTL'] = float(os.environ.get('ADMIN_STATS_TTL', 30))
+# Questions written per transaction when importing quizzes
+app.config['IMPORT_CHUNK_SIZE'] = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))
+# Uploads larger than this many bytes are imported in the background
+app.config['IMPORT_BACKGROUND_BYTES'] = int(os.environ.get('IMPORT_BACKGROUND_BYTES', 1024 * 1024))
+# Seconds a background import's status stays available after its last update
+app.config['IMPORT_JOB_TTL'] = float(os.environ.get('IMPORT_JOB_TTL', 3600))
+# Password hashes allowed to wait for the hashing thread pool before logins are turned away
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 8))
+# How often (seconds) games with new answers are checkpointed
+app.config['CHECKPOINT_INTERVAL'] = float(os.environ.get('CHECKPOINT_INTERVAL', 2))
+# Seconds after its worker stops renewing it that another worker may take a game over
+app.config['CHECKPOINT_LEASE'] = float(os.environ.get('CHECKPOINT_LEASE', 10))
+# Socket.IO events each connection may send per second, and in one burst
+app.config['SOCKET_EVENT_RATE'] = float(os.environ.get('SOCKET_EVENT_RATE', 10))
+app.config['SOCKET_EVENT_BURST'] = int(os.environ.get('SOCKET_EVENT_BURST', 20))
+# Tighter limits for events a player only needs now and then: event -> (per second, burst)
+app.config['SOCKET_EVENT_LIMITS'] = {'join_game': (1, 5), 'submit_answer': (2, 5), 'get_leaderboard': (2, 5)}
+# Connections and running games one worker takes on before answering "server busy"
+app.config['MAX_CONNECTIONS'] = int(os.environ.get('MAX_CONNECTIONS', 5000))
+app.config['MAX_GAMES'] = int(os.environ.get('MAX_GAMES', 200))
+# Seconds before the code of a finished game is handed out again (negative: never reuse codes)
+app.config['GAME_CODE_REUSE_AFTER'] = float(os.environ.get('GAME_CODE_REUSE_AFTER', 3600))
+
+# Message queue shared by all workers so room broadcasts reach every process.
+# Accepts redis://, amqp://, kafka:// URLs, or local:///path/to.sock for the
+# built-in Unix socket broker that needs no outside services.
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+socketio_options = {}
+if SOCKETIO_MESSAGE_QUEUE and SOCKETIO_MESSAGE_QUEUE.startswith('local://'):
+    socketio_options['client_manager'] = LocalSocketManager(SOCKETIO_MESSAGE_QUEUE, channel='flask-socketio')
+elif SOCKETIO_MESSAGE_QUEUE:
+    socketio_options['message_queue'] = SOCKETIO_MESSAGE_QUEUE
+elif os.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+    # Each worker would only see its own sockets and games, so events sent to another worker are lost
+    app.logger.warning(
+        'SOCKETIO_MESSAGE_QUEUE is not set: run gunicorn with a single worker, or set it '
+        '(e.g. local:///tmp/quiz-socketio.sock) so the workers can reach each other'
+    )
 
 # Initialize extensions
 db.init_app(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", json=socket_json, **socketio_options)
+db_writer = SingleWriter(socketio, app) if app.config['SQLITE_SINGLE_WRITER'] else None
+answer_writer = MicroBatcher(socketio, app, write_answers, interval=app.config['ANSWER_FLUSH_INTERVAL'], writer=db_writer)
+worker_bus = WorkerBus(socketio, app)
+answer_tally = TallyAggregator(socketio, interval=app.config['TALLY_INTERVAL'])
+rate_limiter = RateLimiter(
+    (app.config['SOCKET_EVENT_RATE'], app.config['SOCKET_EVENT_BURST']), app.config['SOCKET_EVENT_LIMITS']
+)
+admission = Admission(app.config['MAX_CONNECTIONS'], app.config['MAX_GAMES'])
+password_hasher = PasswordHasher(socketio.async_mode, max_pending=app.config['PASSWORD_HASH_MAX_PENDING'])
 
 # Create database tables
 with app.app_context():
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        configure_sqlite(db.engine)
     db.create_all()
+    add_missing_columns(db.engine)
+    create_missing_indexes(db.engine)
+    metrics.instrument_engine(db.engine)
+    # Other workers may still have a finished game cached under its code
+    reuse_codes = (
+        app.config['GAME_CODE_REUSE_AFTER'] >= 0 and not SOCKETIO_MESSAGE_QUEUE and game_codes_reusable(db.engine)
+    )
     print("Database tables created!")
 
-# Helper function to generate game code
-def generate_game_code():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+metrics.instrument_flask(app)
+
+game_codes = GameCodeAllocator(
+    app.config['SECRET_KEY'], reuse_after=app.config['GAME_CODE_REUSE_AFTER'] if reuse_codes else None
+)
+
+# Helper function to delete a quiz's questions and everything hanging off them,
+# as a few set-based statements instead of loading the rows
+def delete_questions(quiz_id):
+    question_ids = select(Question.question_id).where(Question.quiz_id == quiz_id)
+    bulk_delete(ParticipantAnswer, ParticipantAnswer.question_id.in_(question_ids))
+    bulk_delete(Answer, Answer.question_id.in_(question_ids))
+    bulk_delete(Question, Question.quiz_id == quiz_id)
+
+# Helper function to delete every game played with a quiz, with its players and their answers
+def delete_game_history(quiz_id):
+    session_ids = select(GameSession.game_session_id).where(GameSession.quiz_id == quiz_id)
+    participant_ids = select(Participant.participant_id).where(Participant.game_session_id.in_(session_ids))
+    bulk_delete(ParticipantAnswer, ParticipantAnswer.participant_id.in_(participant_ids))
+    bulk_delete(Participant, Participant.game_session_id.in_(session_ids))
+    bulk_delete(GameCheckpoint, GameCheckpoint.game_session_id.in_(session_ids))
+    bulk_delete(GameSession, GameSession.quiz_id == quiz_id)
+
+# Helper function for a plain DELETE ... WHERE; skipping session sync keeps
+# SQLAlchemy from fetching the ids of every deleted row
+def bulk_delete(model, condition):
+    db.session.execute(delete(model).where(condition).execution_options(synchronize_session=False))
+
+# Helper function to send the players connected to this worker a leaderboard built
+# around their own rank; every worker does this for its own players
+def emit_personal_leaderboards(event, game_code):
+    game = game_state.get_game(game_code)
+    if game is None:
+        return
+    top = game.top(app.config['LEADERBOARD_TOP_N'])
+    sockets = game.sockets
+    
+    for participant_id, sid in sockets.items():
+        rank = game.rank(participant_id)
+        if rank is None:
+            continue
+        
+        # The player plus whoever is directly above and below them
+        neighbours = game.slice(max(rank - 2, 0), rank + 1)
+        first_rank = max(rank - 1, 1)
+        for offset, entry in enumerate(neighbours):
+            entry['rank'] = first_rank + offset
+        me = next(entry for entry in neighbours if entry['participant_id'] == participant_id)
+        
+        socketio.emit(event, {'leaderboard': top, 'me': me, 'neighbours': neighbours}, to=sid, ignore_queue=True)
+    
+    # Pages that joined without telling us who they are just get the top N
+    socketio.emit(event, {'leaderboard': top}, room=game_code, skip_sid=list(sockets.values()), ignore_queue=True)
+
+# Every worker keeps a copy of the leaderboards of the games its players are in,
+# so score changes are published for all of them to apply
+@worker_bus.on('scores')
+def update_scores(changed):
+    game = game_state.games.get(changed['game_code'])
+    if game is not None:
+        for participant_id, score in changed['scores']:
+            game.set_score(participant_id, score)
+
+@worker_bus.on('show_leaderboard')
+def handle_show_leaderboard(shown):
+    emit_personal_leaderboards('show_leaderboard', shown['game_code'])
+
+@worker_bus.on('game_ended')
+def handle_game_ended(ended):
+    emit_personal_leaderboards('game_ended', ended['game_code'])
+    game_state.forget_game(ended['game_code'])
+    answer_tally.forget(ended['game_code'])
+    checkpoints.forget(ended['game_code'])
+
+# Helper function to score a correct answer: full points straight away, half at the buzzer
+def score_answer(points, time_limit, elapsed):
+    return int(points * (1 - (elapsed / time_limit) * 0.5))
+
+# Called by the scheduler when a question closes: grade every answer in one batch
+def grade_question(game_code, open_question):
+    game = game_state.get_game(game_code)
+    if game is None:
+        return
+    correct_answer_ids = game.answer_key.get(open_question.question_id, frozenset())
+    
+    results = []
+    for participant_id, (answer_ids, elapsed, sid) in open_question.submissions.items():
+        is_correct = answer_ids == correct_answer_ids
+        points = score_answer(open_question.points, open_question.time_limit, elapsed) if is_correct else 0
+        results.append((participant_id, sid, is_correct, points, {
+            'participant_id': participant_id,
+            'points': points,
+            'rows': [{
+                'participant_id': participant_id,
+                'question_id': open_question.question_id,
+                'answer_id': answer_id,
+                'time_taken': int(elapsed),
+                'points_earned': points
+            } for answer_id in answer_ids]
+        }))
+    
+    try:
+        errors = answer_writer.submit_many([item for *_, item in results])
+    except Exception as e:
+        app.logger.exception('Saving the answers to question %s failed', open_question.question_id)
+        errors = [e] * len(results)
+    
+    # Players whose answers could not be saved are not scored, but the question still closes below
+    failed = [result for result, error in zip(results, errors) if error is not None]
+    if failed:
+        app.logger.error('%d answers to question %s could not be saved', len(failed), open_question.question_id)
+        socketio.emit('error', {'message': f'Failed to save {len(failed)} answers'}, room=f'host_{game_code}')
+        for participant_id, sid, *_ in failed:
+            socketio.emit('error', {'message': 'Your answer could not be saved'}, to=sid or f'player_{participant_id}')
+        results = [result for result, error in zip(results, errors) if error is None]
+    
+    try:
+        scores = []
+        for participant_id, sid, is_correct, points, _ in results:
+            game.record_result(participant_id, is_correct, points)
+            if points and participant_id in game:
+                scores.append([participant_id, game.score(participant_id)])
+            # Answers restored from a checkpoint go to the player's current page
+            socketio.emit('answer_result', {
+                'question_id': open_question.question_id,
+                'correct': is_correct,
+                'points_earned': points,
+                'total_score': game.score(participant_id),
+                'streak': game.streak(participant_id),
+                'correct_answer_ids': sorted(correct_answer_ids)
+            }, to=sid or f'player_{participant_id}')
+        if scores:
+            worker_bus.publish('scores', {'game_code': game_code, 'scores': scores})
+    finally:
+        game.close_question()
+        checkpoints.save(game_code)
+        socketio.emit('question_closed', {'question_id': open_question.question_id}, room=f'host_{game_code}')
+
+question_scheduler = QuestionScheduler(socketio, app, grade_question, grace=app.config['ANSWER_GRACE_PERIOD'])
+
+# Game commands by name, each run by the worker running the game as command(game_code, data, sid)
+game_commands = {}
+
+def game_command(name):
+    def register(function):
+        game_commands[name] = function
+        return function
+    return register
+
+# Helper function to run a game command on the worker running the game: here if this
+# worker holds (or can take) the game's lease, otherwise on its owner via the worker bus
+def run_on_owner(name, game_code, data, sid):
+    if checkpoints.claim(game_code):
+        game_commands[name](game_code, data, sid)
+    elif checkpoints.running_elsewhere(game_code):
+        worker_bus.publish('game_command', {'name': name, 'game_code': game_code, 'data': data, 'sid': sid})
+    else:
+        # Its owner has gone quiet without giving the lease up; a worker takes it over once the lease runs out
+        socketio.emit('error', {'message': 'This game is not running right now, please try again in a few seconds'}, to=sid)
+
+@worker_bus.on('game_command')
+def handle_game_command(message):
+    # Every worker hears the command, only the owner runs it
+    if checkpoints.owns(message['game_code']):
+        game_commands[message['name']](message['game_code'], message['data'], message['sid'])
+
+# Called after each committed batch of joins: tell every host about its new players in one event
+def announce_participants(items, participant_ids):
+    joined = {}
+    for item, participant_id in zip(items, participant_ids):
+        joined.setdefault(item['game_code'], []).append({
+            'participant_id': participant_id,
+            'nickname': item['nickname']
+        })
+    for game_code, participants in joined.items():
+        socketio.emit('participants_joined', {'participants': participants}, to=f'host_{game_code}')
+    # Every worker keeps a copy of the game's leaderboard
+    worker_bus.publish('participants_joined', joined)
+
+@worker_bus.on('participants_joined')
+def register_participants(joined):
+    for game_code, participants in joined.items():
+        for participant in participants:
+            game_state.register_participant(participant['participant_id'], game_code, participant['nickname'])
+
+join_writer = MicroBatcher(
+    socketio, app, write_participants,
+    interval=app.config['JOIN_FLUSH_INTERVAL'], after_commit=announce_participants, writer=db_writer
+)
+
+# Helper function for socket handlers that write outside the batchers
+def write_now(function, *args, **kwargs):
+    if db_writer is not None:
+        return db_writer.call(function, *args, **kwargs)
+    try:
+        result = function(*args, **kwargs)
+        db.session.commit()
+        return result
+    except Exception:
+        db.session.rollback()
+        raise
+
+# Helper function: whether a host or player page of the game is connected to this worker
+def game_in_use(game_code):
+    rooms = socketio.server.manager.rooms.get('/', {})
+    return bool(rooms.get(f'host_{game_code}') or rooms.get(game_code))
+
+checkpoints = Checkpointer(
+    socketio, app, question_scheduler, write_now, worker_bus, game_in_use,
+    interval=app.config['CHECKPOINT_INTERVAL'], lease=app.config['CHECKPOINT_LEASE'],
+    answer_interval=app.config['ANSWER_FLUSH_INTERVAL']
+)
+game_state.checkpoints = checkpoints
+# Another worker can take this one's games over straight away after a clean shutdown
+atexit.register(checkpoints.release_all)
+
+# Too many logins at once: ask the client to retry rather than queue more hashing
+@app.errorhandler(HashingBusy)
+def handle_hashing_busy(e):
+    response = jsonify({'error': 'Server is busy, please try again in a moment'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 # Routes
 @app.route('/')
@@ -67,6 +375,11 @@ def play_game(game_code):
 def host_game(game_code):
     return render_template('host_game.html', game_code=game_code)
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Handler latencies, SQL counts and room sizes in Prometheus text format"""
+    return metrics.metrics_response()
+
 @app.route('/api/register', methods=['POST'])
 def register():
     data = request.json
@@ -81,7 +394,7 @@ def register():
         return jsonify({'error': 'Username already exists'}), 400
     
     # Create new admin
-    hashed_password = generate_password_hash(data['password'])
+    hashed_password = password_hasher.hash(data['password'])
     new_admin = Admin(
         username=data['username'],
         email=email,
@@ -103,7 +416,7 @@ def login():
     email = data['email'].lower()
     admin = Admin.query.filter_by(email=email).first()
     
-    if admin and check_password_hash(admin.password_hash, data['password']):
+    if admin and password_hasher.check(admin.password_hash, data['password']):
         return jsonify({
             'message': 'Login successful',
             'admin_id': admin.admin_id,
@@ -125,6 +438,7 @@ def create_quiz():
     
     db.session.add(new_quiz)
     db.session.commit()
+    admin_stats.invalidate(new_quiz.admin_id)
     
     return jsonify({
         'message': 'Quiz created successfully',
@@ -166,7 +480,11 @@ def add_question(quiz_id):
         )
         db.session.add(new_answer)
     
+    # Bump the version so cached snapshots of this quiz are rebuilt
+    quiz.updated_at = datetime.now(timezone.utc)
     db.session.commit()
+    quiz_cache.invalidate(quiz_id)
+    admin_stats.invalidate(quiz.admin_id)
     
     return jsonify({
         'message': 'Question added successfully',
@@ -186,30 +504,14 @@ def delete_all_questions(quiz_id):
         return jsonify({'error': 'Unauthorized: You do not have permission to edit this quiz'}), 403
     
     try:
-        # Get all questions for this quiz
-        questions = Question.query.filter_by(quiz_id=quiz_id).all()
-        
         # Delete in correct order: participant_answers -> answers -> questions
-        for question in questions:
-            # Delete participant answers first (they reference answers)
-            participant_answers = ParticipantAnswer.query.filter_by(question_id=question.question_id).all()
-            for pa in participant_answers:
-                db.session.delete(pa)
-            
-            # Delete answers
-            answers = Answer.query.filter_by(question_id=question.question_id).all()
-            for answer in answers:
-                db.session.delete(answer)
-        
-        # Flush to ensure all dependent records are deleted
-        db.session.flush()
-        
-        # Delete all questions
-        for question in questions:
-            db.session.delete(question)
+        delete_questions(quiz_id)
         
         # Commit all deletions
+        quiz.updated_at = datetime.now(timezone.utc)
         db.session.commit()
+        quiz_cache.invalidate(quiz_id)
+        admin_stats.invalidate(quiz.admin_id)
         return jsonify({'message': 'All questions deleted successfully'}), 200
     except Exception as e:
         db.session.rollback()
@@ -228,45 +530,20 @@ def get_quiz(quiz_id):
     if not admin_id or quiz.admin_id != admin_id:
         return jsonify({'error': 'Unauthorized: You do not have permission to access this quiz'}), 403
     
-    questions_data = []
-    for question in quiz.questions:
-        answers_data = []
-        for answer in question.answers:
-            answers_data.append({
-                'answer_id': answer.answer_id,
-                'answer_text': answer.answer_text,
-                'is_correct': answer.is_correct,
-                'answer_order': answer.answer_order
-            })
-        
-        questions_data.append({
-            'question_id': question.question_id,
-            'question_text': question.question_text,
-            'question_order': question.question_order,
-            'time_limit': question.time_limit,
-            'points': question.points,
-            'answers': sorted(answers_data, key=lambda x: x['answer_order'])
-        })
-    
-    return jsonify({
-        'quiz_id': quiz.quiz_id,
-        'title': quiz.title,
-        'description': quiz.description,
-        'questions': sorted(questions_data, key=lambda x: x['question_order'])
-    }), 200
+    # The snapshot is already sorted and serialized
+    snapshot = quiz_cache.get_snapshot(quiz)
+    return app.response_class(snapshot.json, mimetype='application/json'), 200
 
 @app.route('/api/admin/<int:admin_id>/quizzes', methods=['GET'])
 def get_admin_quizzes(admin_id):
-    quizzes = Quiz.query.filter_by(admin_id=admin_id).all()
-    
     quiz_list = []
-    for quiz in quizzes:
+    for quiz in admin_stats.question_counts(admin_id):
         quiz_list.append({
             'quiz_id': quiz.quiz_id,
             'title': quiz.title,
             'description': quiz.description,
             'created_at': quiz.created_at.strftime('%Y-%m-%d'),
-            'question_count': len(quiz.questions)
+            'question_count': quiz.question_count
         })
     
     return jsonify(quiz_list), 200
@@ -278,53 +555,8 @@ def get_admin_stats(admin_id):
     if not admin:
         return jsonify({'error': 'Admin not found'}), 404
     
-    # Get total quizzes
-    total_quizzes = len(admin.quizzes)
-    
-    # Get total questions
-    total_questions = 0
-    for quiz in admin.quizzes:
-        total_questions += len(quiz.questions)
-    
-    # Get total games hosted
-    total_games = len(admin.game_sessions)
-    
-    # Get total participants across all games
-    total_participants = 0
-    for game in admin.game_sessions:
-        total_participants += len(game.participants)
-    
-    # Get recent activity
-    recent_activity = []
-    for quiz in admin.quizzes:
-        recent_activity.append({
-            'title': quiz.title,
-            'type': 'Quiz Created',
-            'date': quiz.created_at.strftime('%Y-%m-%d %H:%M'),
-            'timestamp': quiz.created_at
-        })
-        # Add game sessions for this quiz
-        for game in quiz.game_sessions:
-            if game.started_at:
-                recent_activity.append({
-                    'title': quiz.title,
-                    'type': 'Game Hosted',
-                    'date': game.started_at.strftime('%Y-%m-%d %H:%M'),
-                    'timestamp': game.started_at
-                })
-    
-    # Sort by timestamp descending, then remove timestamp field
-    recent_activity.sort(key=lambda x: x['timestamp'], reverse=True)
-    for item in recent_activity:
-        del item['timestamp']
-    
-    return jsonify({
-        'total_quizzes': total_quizzes,
-        'total_questions': total_questions,
-        'total_games': total_games,
-        'total_participants': total_participants,
-        'recent_activity': recent_activity[:10]  # Limit to 10 items
-    }), 200
+    # Totals and recent activity come from a few aggregate queries
+    return jsonify(admin_stats.get_stats(admin_id, app.config['ADMIN_STATS_TTL'])), 200
 
 @app.route('/api/quiz/<int:quiz_id>', methods=['PUT'])
 def update_quiz(quiz_id):
@@ -346,6 +578,8 @@ def update_quiz(quiz_id):
     
     try:
         db.session.commit()
+        quiz_cache.invalidate(quiz_id)
+        admin_stats.invalidate(quiz.admin_id)
         return jsonify({'message': 'Quiz updated successfully'}), 200
     except Exception as e:
         db.session.rollback()
@@ -367,8 +601,12 @@ def delete_quiz(quiz_id):
         return jsonify({'error': 'Unauthorized: You do not have permission to delete this quiz'}), 403
     
     try:
-        db.session.delete(quiz)
+        delete_questions(quiz_id)
+        delete_game_history(quiz_id)
+        bulk_delete(Quiz, Quiz.quiz_id == quiz_id)
         db.session.commit()
+        quiz_cache.invalidate(quiz_id)
+        admin_stats.invalidate(admin_id)
         return jsonify({'message': 'Quiz deleted successfully'}), 200
     except Exception as e:
         db.session.rollback()
@@ -385,11 +623,11 @@ def update_admin_settings(admin_id):
     # Verify current password if trying to change password
     if data.get('new_password'):
         current_password = data.get('current_password')
-        if not current_password or not check_password_hash(admin.password_hash, current_password):
+        if not current_password or not password_hasher.check(admin.password_hash, current_password):
             return jsonify({'error': 'Current password is incorrect'}), 401
         
         # Update password
-        admin.password_hash = generate_password_hash(data['new_password'])
+        admin.password_hash = password_hasher.hash(data['new_password'])
     
     try:
         db.session.commit()
@@ -402,17 +640,25 @@ def update_admin_settings(admin_id):
 def start_game():
     data = request.json
     
-    game_code = generate_game_code()
-    
-    new_session = GameSession(
-        quiz_id=data['quiz_id'],
-        admin_id=data['admin_id'],
-        game_code=game_code,
-        status='waiting'
-    )
-    
-    db.session.add(new_session)
-    db.session.commit()
+    # New codes can only clash with codes from before the allocator or another SECRET_KEY
+    for attempt in range(3):
+        game_code = game_codes.allocate()
+        new_session = GameSession(
+            quiz_id=data['quiz_id'],
+            admin_id=data['admin_id'],
+            game_code=game_code,
+            status='waiting'
+        )
+        db.session.add(new_session)
+        try:
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == 2:
+                raise
+    game_state.register_game(game_code, new_session.game_session_id)
+    admin_stats.invalidate(new_session.admin_id)
     
     return jsonify({
         'message': 'Game session created',
@@ -420,214 +666,256 @@ def start_game():
         'game_session_id': new_session.game_session_id
     }), 201
 
+# Helper function for admission control: games already hosted from this worker are
+# always let through, new ones only while there is room for them
+def admit_game(game_code, event_name):
+    rooms = socketio.server.manager.rooms.get('/', {})
+    hosted = {room[len('host_'):] for room, members in rooms.items() if room and room.startswith('host_') and members}
+    if game_code in hosted or admission.admit_game(len(hosted)):
+        return True
+    emit('server_busy', busy(
+        event_name, 'too_many_games', 'This server is running as many games as it can, please try again shortly', 30
+    ))
+    return False
+
 # SocketIO events for real-time communication
+@socketio.on('connect')
+def handle_connect(auth=None):
+    if not admission.admit_connection():
+        raise ConnectionRefusedError('server_busy', busy(
+            'connect', 'too_many_connections', 'This server is full, please try again shortly', 5
+        ))
+
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    admission.release_connection()
+    rate_limiter.forget(request.sid)
+
 @socketio.on('join_game')
 def handle_join_game(data):
     game_code = data['game_code']
     nickname = data['nickname']
-    print(f"[DEBUG] Player {nickname} attempting to join game: {game_code}")
+    app.logger.debug(f"Player {nickname} attempting to join game: {game_code}")
     
-    # Find game session
-    session = GameSession.query.filter_by(game_code=game_code).first()
+    # Find game session (cached after the first player's lookup)
+    session_id = game_state.get_session_id(game_code)
     
-    if not session:
-        print(f"[DEBUG] Game session not found for code: {game_code}")
+    if session_id is None:
+        app.logger.debug(f"Game session not found for code: {game_code}")
         emit('error', {'message': 'Game not found'})
         return
     
-    print(f"[DEBUG] Game session found. Creating participant...")
-    # Create participant
-    participant = Participant(
-        game_session_id=session.game_session_id,
-        nickname=nickname
-    )
-    
-    db.session.add(participant)
-    db.session.commit()
+    # Create participant, inserted together with everyone else joining right now
+    participant_id = join_writer.submit({
+        'game_code': game_code,
+        'game_session_id': session_id,
+        'nickname': nickname
+    })
+    game_state.register_participant(participant_id, game_code, nickname)
     
     # Join the game code room so player receives game_started event
     join_room(game_code)
-    print(f"[DEBUG] Participant {nickname} joined room: {game_code}")
+    app.logger.debug(f"Participant {nickname} joined room: {game_code}")
     
     # Notify player they joined
+    # The host hears about it from the batch's participants_joined event
     emit('joined', {
-        'participant_id': participant.participant_id,
+        'participant_id': participant_id,
         'nickname': nickname
     })
-    
-    # Notify host that someone joined
-    emit('participant_joined', {
-        'participant_id': participant.participant_id,
-        'nickname': nickname
-    }, room=f'host_{game_code}')
-    print(f"[DEBUG] Notified host about new participant in game: {game_code}")
 
 @socketio.on('join_room')
 def handle_join_room(data):
     """Join a socket room to receive broadcasts (used by play_game.html)"""
     game_code = data['game_code']
-    print(f"[DEBUG] Socket joining room for game code: {game_code}")
+    app.logger.debug(f"Socket joining room for game code: {game_code}")
     join_room(game_code)
-    print(f"[DEBUG] Socket joined room: {game_code}")
+    if data.get('participant_id'):
+        participant_id = int(data['participant_id'])
+        # Lets whichever worker runs the game reach the player's page
+        join_room(f'player_{participant_id}')
+        game_state.register_player_socket(game_code, participant_id, request.sid)
+    app.logger.debug(f"Socket joined room: {game_code}")
 
 @socketio.on('join_host_room')
 def handle_join_host_room(data):
     game_code = data['game_code']
+    if not admit_game(game_code, 'join_host_room'):
+        return
     join_room(f'host_{game_code}')
+    # The host's worker runs the game, unless another worker still holds its lease
+    checkpoints.claim(game_code)
     
-    # Send quiz data to host
-    session = GameSession.query.filter_by(game_code=game_code).first()
-    if session:
-        quiz = Quiz.query.get(session.quiz_id)
-        questions_data = []
-        
-        for question in quiz.questions:
-            answers_data = []
-            for answer in question.answers:
-                answers_data.append({
-                    'answer_id': answer.answer_id,
-                    'answer_text': answer.answer_text,
-                    'is_correct': answer.is_correct
-                })
-            
-            questions_data.append({
-                'question_id': question.question_id,
-                'question_text': question.question_text,
-                'time_limit': question.time_limit,
-                'points': question.points,
-                'answers': answers_data
-            })
-        
-        emit('quiz_data', {'questions': questions_data})
+    # Send quiz data to host, straight from the compiled snapshot
+    quiz = Quiz.query.join(GameSession).filter(
+        GameSession.game_session_id == game_state.get_session_id(game_code)
+    ).first()
+    if quiz:
+        emit('quiz_data', {'questions': quiz_cache.get_snapshot(quiz).questions})
 
 @socketio.on('start_game')
 def handle_start_game(data):
     game_code = data['game_code']
-    print(f"[DEBUG] Admin starting game with code: {game_code}")
+    app.logger.debug(f"Admin starting game with code: {game_code}")
+    
+    if not admit_game(game_code, 'start_game'):
+        return
+    checkpoints.claim(game_code)
     
     # Update game session status
-    session = GameSession.query.filter_by(game_code=game_code).first()
+    session_id = game_state.get_session_id(game_code)
+    session = db.session.get(GameSession, session_id) if session_id else None
     if session:
-        print(f"[DEBUG] Game session found: {session.game_code}, status: {session.status}")
-        session.status = 'active'
-        session.started_at = datetime.now(timezone.utc)
-        db.session.commit()
-        print(f"[DEBUG] Emitting game_started to room: {game_code}")
+        app.logger.debug(f"Game session found: {session.game_code}, status: {session.status}")
+        write_now(update_game_session, session.game_session_id, status='active', started_at=datetime.now(timezone.utc))
+        admin_stats.invalidate(session.admin_id)
+        
+        # Compile the answer key and load the players once so grading never has to hit the database
+        game_state.build_game(game_code)
+        app.logger.debug(f"Emitting game_started to room: {game_code}")
     else:
-        print(f"[DEBUG] Game session NOT found for code: {game_code}")
+        app.logger.debug(f"Game session NOT found for code: {game_code}")
     
     emit('game_started', {}, room=game_code)
-    print(f"[DEBUG] game_started emitted to room: {game_code}")
+    app.logger.debug(f"game_started emitted to room: {game_code}")
 
 @socketio.on('show_question')
 def handle_show_question(data):
-    game_code = data['game_code']
-    question = data['question']
-    print(f"[DEBUG] Broadcasting show_question to room {game_code}: Question {question.get('question_number')}")
-    
-    emit('show_question', question, room=game_code)
-    print(f"[DEBUG] show_question broadcast complete")
+    run_on_owner('show_question', data['game_code'], data, request.sid)
+
+@game_command('show_question')
+def show_question(game_code, data, sid):
+    # Players get the question as compiled from the quiz, not what the host page sent,
+    # so the answer key stays on the host's screen
+    question_id = int(data['question']['question_id'])
+    game = game_state.get_game(game_code)
+    settings = game.question_settings.get(question_id) if game is not None else None
+    if settings is None:
+        socketio.emit('error', {'message': 'Question not found'}, to=sid)
+        return
+    time_limit, points = settings
+    question = game.question_payloads[question_id]
+    app.logger.debug(f"Broadcasting show_question to room {game_code}: Question {question['question_number']}")
+    
+    question_scheduler.open(game_code, question_id, time_limit, points)
+    game.open_question(question_id)
+    checkpoints.save(game_code)
+    answer_tally.reset(game_code, question_id)
+    socketio.emit('show_question', question, room=game_code)
+    app.logger.debug("show_question broadcast complete")
 
 @socketio.on('submit_answer')
 def handle_submit_answer(data):
+    game_code = game_state.game_code_for(int(data['participant_id']))
+    if game_code is None:
+        emit('error', {'message': 'Game not found'})
+        return
+    run_on_owner('submit_answer', game_code, data, request.sid)
+
+@game_command('submit_answer')
+def submit_answer(game_code, data, sid):
     # Handle both single answer (backwards compatibility) and multiple answers
     answer_ids = data.get('answer_ids', [data['answer_id']] if 'answer_id' in data else [])
+    participant_id = int(data['participant_id'])
+    question_id = int(data['question_id'])
     
-    # Check if all answers are correct BEFORE updating scores
-    question = Question.query.get(data['question_id'])
-    correct_answers = Answer.query.filter_by(question_id=data['question_id'], is_correct=True).all()
-    correct_answer_ids = set(a.answer_id for a in correct_answers)
-    selected_answer_ids = set(answer_ids)
+    game = game_state.get_game(game_code)
+    if game is None:
+        socketio.emit('error', {'message': 'Game not found'}, to=sid)
+        return
     
-    # Answers are correct if the selected set exactly matches the correct set
-    is_correct = selected_answer_ids == correct_answer_ids
-    
-    # Only award points if the answer is correct
-    points_to_award = data['points_earned'] if is_correct else 0
-    
-    # Create participant answers for each selected answer
-    for answer_id in answer_ids:
-        participant_answer = ParticipantAnswer(
-            participant_id=data['participant_id'],
-            question_id=data['question_id'],
-            answer_id=answer_id,
-            time_taken=data['time_taken'],
-            points_earned=points_to_award
-        )
-        db.session.add(participant_answer)
+    # The player hears back once the answer is in a committed checkpoint, so an
+    # acknowledged answer is graded even if this worker dies before the question closes
+    def acknowledge():
+        socketio.emit('answer_received', {'question_id': question_id}, to=sid)
     
-    # Update participant total score (only with correct answer points)
-    participant = Participant.query.get(data['participant_id'])
-    participant.total_score += points_to_award
+    # Double clicks and reconnect replays get the same acknowledgement and nothing else
+    if game.has_answered(participant_id, question_id):
+        metrics.increment('quiz_duplicate_answers_total')
+        # Acknowledged along with the first copy, which needs no second checkpoint
+        checkpoints.after_save(game_code, acknowledge)
+        return
     
-    db.session.commit()
+    # Only ids of the question's own answers get as far as the scheduler and the database
+    try:
+        selected_answer_ids = frozenset(int(answer_id) for answer_id in answer_ids)
+    except (TypeError, ValueError):
+        selected_answer_ids = None
+    if selected_answer_ids is None or not selected_answer_ids <= game.answer_choices.get(question_id, frozenset()):
+        socketio.emit('error', {'message': 'Invalid answer'}, to=sid)
+        return
     
-    # Notify host
-    game_session = GameSession.query.join(Participant).filter(
-        Participant.participant_id == data['participant_id']
-    ).first()
+    # Stamp the answer with the server clock; it is graded and saved when the question
+    # closes, and the player gets an answer_result then. Client timings are ignored.
+    elapsed = question_scheduler.submit(game_code, participant_id, question_id, selected_answer_ids, sid)
+    if elapsed is None:
+        socketio.emit('error', {'message': 'This question is closed'}, to=sid)
+        return
+    
+    game.mark_answered(participant_id)
+    checkpoints.mark(game_code, on_saved=acknowledge)
     
-    if game_session:
-        emit('answer_submitted', {
-            'participant_id': data['participant_id'],
-            'correct': is_correct,
-            'time_taken': data['time_taken']
-        }, room=f'host_{game_session.game_code}')
+    # Answers are correct if the selected set exactly matches the correct set
+    is_correct = selected_answer_ids == game.answer_key.get(question_id, frozenset())
     
-    emit('answer_submitted', {'success': True})
+    # Host gets the running totals on the next tally tick rather than one event per answer
+    answer_tally.record(game_code, question_id, selected_answer_ids, is_correct, elapsed)
+
+@socketio.on('close_question')
+def handle_close_question(data):
+    run_on_owner('close_question', data['game_code'], data, request.sid)
+
+@game_command('close_question')
+def close_question(game_code, data, sid):
+    """Host skipped the rest of the countdown"""
+    if question_scheduler.close(game_code) is None:
+        # Nothing was open (it already timed out), let the host move on anyway
+        socketio.emit('question_closed', {'question_id': None}, to=sid)
 
 @socketio.on('get_leaderboard')
 def handle_get_leaderboard(data):
     game_code = data['game_code']
     
-    session = GameSession.query.filter_by(game_code=game_code).first()
-    if session:
-        participants = Participant.query.filter_by(
-            game_session_id=session.game_session_id
-        ).order_by(Participant.total_score.desc()).all()
-        
-        leaderboard = []
-        for p in participants:
-            leaderboard.append({
-                'participant_id': p.participant_id,
-                'nickname': p.nickname,
-                'total_score': p.total_score
-            })
-        
-        emit('leaderboard_data', {'leaderboard': leaderboard})
+    # The question is over, so make sure buffered answers are counted
+    answer_writer.flush()
+    
+    game = game_state.get_game(game_code)
+    emit('leaderboard_data', {'leaderboard': game.top() if game is not None else []})
 
 @socketio.on('broadcast_leaderboard')
 def handle_broadcast_leaderboard(data):
     game_code = data['game_code']
-    leaderboard = data['leaderboard']
     
-    emit('show_leaderboard', {'leaderboard': leaderboard}, room=game_code)
+    if 'leaderboard' in data:
+        # Older host pages send the whole list for us to relay to everyone
+        emit('show_leaderboard', {'leaderboard': data['leaderboard']}, room=game_code)
+        return
+    
+    run_on_owner('broadcast_leaderboard', game_code, data, request.sid)
+
+@game_command('broadcast_leaderboard')
+def broadcast_leaderboard(game_code, data, sid):
+    answer_writer.flush()
+    worker_bus.publish('show_leaderboard', {'game_code': game_code})
 
 @socketio.on('end_game')
 def handle_end_game(data):
-    game_code = data['game_code']
+    run_on_owner('end_game', data['game_code'], data, request.sid)
+
+@game_command('end_game')
+def end_game(game_code, data, sid):
+    question_scheduler.close(game_code)
+    answer_writer.flush()
     
     # Update game session
-    session = GameSession.query.filter_by(game_code=game_code).first()
-    if session:
-        session.status = 'completed'
-        session.ended_at = datetime.now(timezone.utc)
-        db.session.commit()
+    session_id = game_state.get_session_id(game_code)
+    if session_id:
+        write_now(update_game_session, session_id, status='completed', ended_at=datetime.now(timezone.utc))
+        checkpoints.discard(game_code, session_id)
+        game_codes.release(game_code)
         
-        # Get final leaderboard
-        participants = Participant.query.filter_by(
-            game_session_id=session.game_session_id
-        ).order_by(Participant.total_score.desc()).all()
-        
-        leaderboard = []
-        for p in participants:
-            leaderboard.append({
-                'participant_id': p.participant_id,
-                'nickname': p.nickname,
-                'total_score': p.total_score
-            })
-        
-        emit('game_ended', {'leaderboard': leaderboard}, room=game_code)
+        # Final standings come from the live leaderboards, scores are already saved
+        worker_bus.publish('game_ended', {'game_code': game_code})
 
 # Export/Import Endpoints
 @app.route('/api/quiz/<int:quiz_id>/export', methods=['GET'])
@@ -645,7 +933,8 @@ def export_quiz(quiz_id):
     
     export_format = request.args.get('format', 'json').lower()
     
-    # Build quiz data
+    # Build quiz data from the snapshot, leaving out database ids
+    snapshot = quiz_cache.get_snapshot(quiz)
     quiz_data = {
         'quiz_id': quiz.quiz_id,
         'title': quiz.title,
@@ -653,23 +942,18 @@ def export_quiz(quiz_id):
         'questions': []
     }
     
-    for question in sorted(quiz.questions, key=lambda q: q.question_order):
-        question_data = {
-            'question_text': question.question_text,
-            'question_order': question.question_order,
-            'time_limit': question.time_limit,
-            'points': question.points,
-            'answers': []
-        }
-        
-        for answer in sorted(question.answers, key=lambda a: a.answer_order):
-            question_data['answers'].append({
-                'answer_text': answer.answer_text,
-                'is_correct': answer.is_correct,
-                'answer_order': answer.answer_order
-            })
-        
-        quiz_data['questions'].append(question_data)
+    for question in snapshot.questions:
+        quiz_data['questions'].append({
+            'question_text': question['question_text'],
+            'question_order': question['question_order'],
+            'time_limit': question['time_limit'],
+            'points': question['points'],
+            'answers': [{
+                'answer_text': answer['answer_text'],
+                'is_correct': answer['is_correct'],
+                'answer_order': answer['answer_order']
+            } for answer in question['answers']]
+        })
     
     if export_format == 'json':
         # Export as JSON
@@ -695,17 +979,17 @@ def export_quiz(quiz_id):
         writer.writerow(['Question Order', 'Question Text', 'Time Limit (sec)', 'Points', 'Answer Text', 'Is Correct', 'Answer Order'])
         
         # Write data rows
-        for question in sorted(quiz.questions, key=lambda q: q.question_order):
-            for i, answer in enumerate(sorted(question.answers, key=lambda a: a.answer_order)):
+        for question in quiz_data['questions']:
+            for i, answer in enumerate(question['answers']):
                 if i == 0:
                     writer.writerow([
-                        question.question_order,
-                        question.question_text,
-                        question.time_limit,
-                        question.points,
-                        answer.answer_text,
-                        'Yes' if answer.is_correct else 'No',
-                        answer.answer_order
+                        question['question_order'],
+                        question['question_text'],
+                        question['time_limit'],
+                        question['points'],
+                        answer['answer_text'],
+                        'Yes' if answer['is_correct'] else 'No',
+                        answer['answer_order']
                     ])
                 else:
                     writer.writerow([
@@ -713,9 +997,9 @@ def export_quiz(quiz_id):
                         '',
                         '',
                         '',
-                        answer.answer_text,
-                        'Yes' if answer.is_correct else 'No',
-                        answer.answer_order
+                        answer['answer_text'],
+                        'Yes' if answer['is_correct'] else 'No',
+                        answer['answer_order']
                     ])
         
         csv_data = output.getvalue()
@@ -743,89 +1027,21 @@ def export_all_quizzes(admin_id):
     
     export_format = request.args.get('format', 'json').lower()
     
-    quizzes_data = []
-    for quiz in admin.quizzes:
-        quiz_data = {
-            'quiz_id': quiz.quiz_id,
-            'title': quiz.title,
-            'description': quiz.description,
-            'questions': []
-        }
-        
-        for question in sorted(quiz.questions, key=lambda q: q.question_order):
-            question_data = {
-                'question_text': question.question_text,
-                'question_order': question.question_order,
-                'time_limit': question.time_limit,
-                'points': question.points,
-                'answers': []
-            }
-            
-            for answer in sorted(question.answers, key=lambda a: a.answer_order):
-                question_data['answers'].append({
-                    'answer_text': answer.answer_text,
-                    'is_correct': answer.is_correct,
-                    'answer_order': answer.answer_order
-                })
-            
-            quiz_data['questions'].append(question_data)
-        
-        quizzes_data.append(quiz_data)
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
     
+    # Streamed straight from a server-side cursor instead of built in memory
     if export_format == 'json':
-        # Export as JSON
-        json_data = json.dumps(quizzes_data, indent=2)
-        return send_file(
-            io.BytesIO(json_data.encode()),
-            mimetype='application/json',
-            as_attachment=True,
-            download_name=f'quizzes_export_{datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")}.json'
-        )
-    
+        pieces, mimetype = quiz_io.export_json(admin_id), 'application/json'
     elif export_format == 'csv':
-        # Export as CSV (combined)
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        writer.writerow(['Quiz Title', 'Description', 'Question Order', 'Question Text', 'Time Limit (sec)', 'Points', 'Answer Text', 'Is Correct', 'Answer Order'])
-        
-        for quiz in admin.quizzes:
-            for question in sorted(quiz.questions, key=lambda q: q.question_order):
-                for i, answer in enumerate(sorted(question.answers, key=lambda a: a.answer_order)):
-                    if i == 0:
-                        writer.writerow([
-                            quiz.title,
-                            quiz.description,
-                            question.question_order,
-                            question.question_text,
-                            question.time_limit,
-                            question.points,
-                            answer.answer_text,
-                            'Yes' if answer.is_correct else 'No',
-                            answer.answer_order
-                        ])
-                    else:
-                        writer.writerow([
-                            '',
-                            '',
-                            '',
-                            '',
-                            '',
-                            '',
-                            answer.answer_text,
-                            'Yes' if answer.is_correct else 'No',
-                            answer.answer_order
-                        ])
-        
-        csv_data = output.getvalue()
-        return send_file(
-            io.BytesIO(csv_data.encode()),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'quizzes_export_{datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")}.csv'
-        )
+        pieces, mimetype = quiz_io.export_csv(admin_id), 'text/csv'
+    else:
+        return jsonify({'error': 'Invalid format. Use "json" or "csv"'}), 400
     
-    return jsonify({'error': 'Invalid format. Use "json" or "csv"'}), 400
+    return Response(
+        stream_with_context(quiz_io.chunked(pieces)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=quizzes_export_{timestamp}.{export_format}'}
+    )
 
 @app.route('/api/admin/<int:admin_id>/quizzes/import', methods=['POST'])
 def import_quiz(admin_id):
@@ -848,132 +1064,34 @@ def import_quiz(admin_id):
     if not file:
         return jsonify({'error': 'No file provided'}), 400
     
+    # Determine file type
+    filename = file.filename.lower()
+    if not filename.endswith(('.json', '.csv')):
+        return jsonify({'error': 'Unsupported file format. Use JSON or CSV'}), 400
+    
+    # Big uploads are spooled to disk and imported while the client polls for progress
+    if (request.content_length or 0) > app.config['IMPORT_BACKGROUND_BYTES']:
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+        os.close(fd)
+        file.save(path)
+        quiz_io.expire_import_jobs(app.config['IMPORT_JOB_TTL'])
+        job_id = quiz_io.start_import_job(admin_id)
+        socketio.start_background_task(run_import_job, job_id, admin_id, path, filename)
+        return jsonify({
+            'message': 'Import started',
+            'job_id': job_id,
+            'status_url': f'/api/admin/{admin_id}/quizzes/import/{job_id}'
+        }), 202
+    
     try:
-        # Determine file type
-        filename = file.filename.lower()
-        
-        if filename.endswith('.json'):
-            # Parse JSON
-            content = file.read().decode('utf-8')
-            data = json.loads(content)
-            
-            # Handle both single quiz and multiple quizzes
-            if isinstance(data, dict) and 'title' in data:
-                # Single quiz
-                quizzes = [data]
-            elif isinstance(data, list):
-                # Multiple quizzes
-                quizzes = data
-            else:
-                return jsonify({'error': 'Invalid JSON format'}), 400
-        
-        elif filename.endswith('.csv'):
-            # Parse CSV
-            content = file.read().decode('utf-8')
-            reader = csv.DictReader(io.StringIO(content))
-            
-            quizzes = {}
-            current_quiz = None
-            current_question = None
-            
-            for row in reader:
-                # Skip empty rows
-                if not any(row.values()):
-                    continue
-                
-                quiz_title = row.get('Quiz Title', '').strip()
-                quiz_desc = row.get('Description', '').strip()
-                
-                if quiz_title:
-                    if quiz_title not in quizzes:
-                        quizzes[quiz_title] = {
-                            'title': quiz_title,
-                            'description': quiz_desc,
-                            'questions': []
-                        }
-                        current_quiz = quizzes[quiz_title]
-                
-                if current_quiz:
-                    question_text = row.get('Question Text', '').strip()
-                    if question_text:
-                        # New question
-                        question_order = int(row.get('Question Order', 1))
-                        time_limit = int(row.get('Time Limit (sec)', 30))
-                        points = int(row.get('Points', 100))
-                        
-                        current_question = {
-                            'question_text': question_text,
-                            'question_order': question_order,
-                            'time_limit': time_limit,
-                            'points': points,
-                            'answers': []
-                        }
-                        current_quiz['questions'].append(current_question)
-                    
-                    # Add answer if present
-                    answer_text = row.get('Answer Text', '').strip()
-                    if answer_text and current_question:
-                        is_correct = row.get('Is Correct', 'No').strip().lower() in ['yes', 'true', '1']
-                        answer_order = int(row.get('Answer Order', 0))
-                        
-                        current_question['answers'].append({
-                            'answer_text': answer_text,
-                            'is_correct': is_correct,
-                            'answer_order': answer_order
-                        })
-            
-            quizzes = list(quizzes.values())
-        
-        else:
-            return jsonify({'error': 'Unsupported file format. Use JSON or CSV'}), 400
-        
-        # Import quizzes
-        imported_count = 0
-        errors = []
-        
-        for quiz_data in quizzes:
-            try:
-                # Create quiz
-                new_quiz = Quiz(
-                    admin_id=admin_id,
-                    title=quiz_data.get('title', 'Imported Quiz'),
-                    description=quiz_data.get('description', '')
-                )
-                db.session.add(new_quiz)
-                db.session.flush()  # Get quiz_id without committing
-                
-                # Add questions
-                for question_data in quiz_data.get('questions', []):
-                    new_question = Question(
-                        quiz_id=new_quiz.quiz_id,
-                        question_text=question_data.get('question_text', ''),
-                        question_order=question_data.get('question_order', 0),
-                        time_limit=question_data.get('time_limit', 30),
-                        points=question_data.get('points', 100)
-                    )
-                    db.session.add(new_question)
-                    db.session.flush()
-                    
-                    # Add answers
-                    for answer_data in question_data.get('answers', []):
-                        new_answer = Answer(
-                            question_id=new_question.question_id,
-                            answer_text=answer_data.get('answer_text', ''),
-                            is_correct=answer_data.get('is_correct', False),
-                            answer_order=answer_data.get('answer_order', 0)
-                        )
-                        db.session.add(new_answer)
-                
-                db.session.commit()
-                imported_count += 1
-            
-            except Exception as e:
-                db.session.rollback()
-                errors.append(f"Failed to import '{quiz_data.get('title', 'Unknown')}': {str(e)}")
+        quizzes = parse_quiz_upload(codecs.getreader('utf-8')(file.stream), filename)
+        imported_count, errors = quiz_io.import_quizzes(admin_id, quizzes, app.config['IMPORT_CHUNK_SIZE'])
         
         if imported_count == 0:
             return jsonify({'error': 'No quizzes were imported', 'details': errors}), 400
         
+        admin_stats.invalidate(admin_id)
+        
         response = {
             'message': f'Successfully imported {imported_count} quiz(zes)',
             'imported_count': imported_count
@@ -986,9 +1104,63 @@ def import_quiz(admin_id):
     
     except json.JSONDecodeError:
         return jsonify({'error': 'Invalid JSON file'}), 400
+    except quiz_io.ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Import failed: {str(e)}'}), 500
 
+@app.route('/api/admin/<int:admin_id>/quizzes/import/<job_id>', methods=['GET'])
+def get_import_status(admin_id, job_id):
+    """Progress of a background import"""
+    request_admin_id = request.args.get('admin_id', type=int)
+    if not request_admin_id or request_admin_id != admin_id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    job = db.session.get(ImportJob, job_id)
+    if not job or job.admin_id != admin_id:
+        return jsonify({'error': 'Import not found'}), 404
+    
+    return jsonify(quiz_io.import_job_status(job)), 200
+
+# Helper function to pick the parser for an uploaded quiz file
+def parse_quiz_upload(stream, filename):
+    if filename.endswith('.json'):
+        return quiz_io.iter_json_quizzes(stream)
+    return quiz_io.iter_csv_quizzes(stream)
+
+# Runs a large import in the background, yielding to other greenlets between chunks
+def run_import_job(job_id, admin_id, path, filename):
+    def progress(imported_count, question_count):
+        quiz_io.update_import_job(job_id, imported_count=imported_count, question_count=question_count)
+        socketio.sleep(0)
+    
+    with app.app_context():
+        try:
+            with open(path, encoding='utf-8', newline='') as stream:
+                imported_count, errors = quiz_io.import_quizzes(
+                    admin_id, parse_quiz_upload(stream, filename),
+                    app.config['IMPORT_CHUNK_SIZE'], progress
+                )
+            result = {'status': 'completed' if imported_count else 'failed', 'imported_count': imported_count, 'warnings': errors}
+            if not imported_count:
+                result['error'] = 'No quizzes were imported'
+        except json.JSONDecodeError:
+            result = {'status': 'failed', 'error': 'Invalid JSON file'}
+        except quiz_io.ImportFormatError as e:
+            result = {'status': 'failed', 'error': str(e)}
+        except Exception as e:
+            db.session.rollback()
+            result = {'status': 'failed', 'error': f'Import failed: {str(e)}'}
+        finally:
+            os.remove(path)
+            admin_stats.invalidate(admin_id)
+        quiz_io.update_import_job(job_id, **result)
+
+# Must run after every @socketio.on handler above has been registered
+metrics.instrument_socketio(socketio)
+limit_socketio(socketio, rate_limiter)
+metrics.gauges.append(game_state.memory_samples)
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     socketio.run(app, host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression check for the game tables.
+
+Seeds a database with a realistic amount of quizzes, games and play history,
+drives the hot paths in-process (answer submission and grading, leaderboards,
+the admin dashboard and exports), and runs EXPLAIN on every SELECT, UPDATE
+and DELETE they issued. Exits with status 1 if any of them falls back to a
+full scan of a table holding at least --min-rows rows.
+
+Examples:
+    python check_query_plans.py                                # temporary SQLite file
+    python check_query_plans.py --database-url postgresql://localhost/quiz_plans
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+
+def seed(db, models, admins, quizzes, questions, games, players):
+    """Bulk-insert several admins' worth of quizzes, games and answers"""
+    from sqlalchemy import insert
+    Admin, Quiz, Question, Answer, GameSession, Participant, ParticipantAnswer = models
+    now = datetime.now(timezone.utc)
+
+    admin_ids = db.session.execute(insert(Admin).returning(Admin.admin_id), [{
+        'username': f'plans{i}', 'email': f'plans{i}@plans.local', 'password_hash': 'x'
+    } for i in range(admins)]).scalars().all()
+
+    quiz_rows = [{
+        'admin_id': admin_ids[i % admins], 'title': f'Quiz {i}', 'description': ''
+    } for i in range(quizzes * admins)]
+    quiz_ids = db.session.execute(insert(Quiz).returning(Quiz.quiz_id), quiz_rows).scalars().all()
+
+    question_rows = [{
+        'quiz_id': quiz_id, 'question_text': f'Question {order}', 'question_order': order,
+        'time_limit': 30, 'points': 100
+    } for quiz_id in quiz_ids for order in range(questions)]
+    question_ids = db.session.execute(insert(Question).returning(Question.question_id), question_rows).scalars().all()
+
+    answer_rows = [{
+        'question_id': question_id, 'answer_text': f'Answer {order}', 'is_correct': order == 0, 'answer_order': order
+    } for question_id in question_ids for order in range(4)]
+    db.session.execute(insert(Answer), answer_rows)
+    first_answer = {question_id: answer_id for question_id, answer_id in db.session.execute(
+        Answer.__table__.select().with_only_columns(Answer.question_id, Answer.answer_id).where(Answer.answer_order == 0)
+    )}
+
+    session_rows = [{
+        'quiz_id': quiz_ids[i % len(quiz_ids)], 'admin_id': admin_ids[i % admins], 'game_code': f'P{i:05d}',
+        'status': 'completed', 'started_at': now, 'ended_at': now
+    } for i in range(games)]
+    session_ids = db.session.execute(insert(GameSession).returning(GameSession.game_session_id), session_rows).scalars().all()
+
+    participant_rows = [{
+        'game_session_id': session_id, 'nickname': f'player{i}', 'total_score': i * 10
+    } for session_id in session_ids for i in range(players)]
+    participant_ids = db.session.execute(
+        insert(Participant).returning(Participant.participant_id, Participant.game_session_id), participant_rows
+    ).all()
+
+    quiz_of_session = {session_id: row['quiz_id'] for session_id, row in zip(session_ids, session_rows)}
+    questions_of_quiz = {}
+    for question_id, row in zip(question_ids, question_rows):
+        questions_of_quiz.setdefault(row['quiz_id'], []).append(question_id)
+    db.session.execute(insert(ParticipantAnswer), [{
+        'participant_id': participant_id, 'question_id': question_id, 'answer_id': first_answer[question_id],
+        'time_taken': 5, 'points_earned': 90
+    } for participant_id, session_id in participant_ids for question_id in questions_of_quiz[quiz_of_session[session_id]]])
+    db.session.commit()
+    return admin_ids[0], quiz_ids[0]
+
+
+def drive(quiz_app, admin_id, quiz_id, players):
+    """Play one game and load the dashboard and exports, like real clients do"""
+    client = quiz_app.app.test_client()
+    quiz = client.get(f'/api/quiz/{quiz_id}?admin_id={admin_id}').get_json()
+    code = client.post('/api/game/start', json={'quiz_id': quiz_id, 'admin_id': admin_id}).get_json()['game_code']
+
+    host = quiz_app.socketio.test_client(quiz_app.app)
+    host.emit('join_host_room', {'game_code': code})
+    sockets = []
+    for i in range(players):
+        player = quiz_app.socketio.test_client(quiz_app.app)
+        player.emit('join_game', {'game_code': code, 'nickname': f'live{i}'})
+        sockets.append(player)
+    eventlet.sleep(0.3)
+    participant_ids = []
+    for player in sockets:
+        joined = [e for e in player.get_received() if e['name'] == 'joined']
+        participant_ids.append(joined[0]['args'][0]['participant_id'])
+        player.emit('join_room', {'game_code': code, 'participant_id': participant_ids[-1]})
+
+    host.emit('start_game', {'game_code': code})
+    for number, question in enumerate(quiz['questions'][:2]):
+        host.emit('show_question', {'game_code': code, 'question': dict(
+            question, question_number=number + 1, total_questions=len(quiz['questions'])
+        )})
+        for player, participant_id in zip(sockets, participant_ids):
+            player.emit('submit_answer', {
+                'participant_id': participant_id,
+                'question_id': question['question_id'],
+                'answer_ids': [question['answers'][0]['answer_id']]
+            })
+        host.emit('close_question', {'game_code': code})
+        host.emit('get_leaderboard', {'game_code': code})
+        host.emit('broadcast_leaderboard', {'game_code': code})
+    host.emit('end_game', {'game_code': code})
+    eventlet.sleep(0.2)
+
+    client.get(f'/api/admin/{admin_id}/stats')
+    client.get(f'/api/admin/{admin_id}/quizzes')
+    client.get(f'/api/quiz/{quiz_id}/export?admin_id={admin_id}&format=json')
+    for export_format in ('json', 'csv'):
+        response = client.get(f'/api/admin/{admin_id}/quizzes/export-all?admin_id={admin_id}&format={export_format}')
+        response.get_data()
+
+
+def full_scans(connection, statement, parameters, table_rows, min_rows):
+    """Tables the plan reads in full, skipping ones too small to matter"""
+    if connection.dialect.name == 'sqlite':
+        plan = [row[-1] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+        # An automatic index is built by scanning the whole table first
+        pattern = re.compile(r'^(?:SCAN (\w+)|SEARCH (\w+) USING AUTOMATIC)')
+    else:
+        plan = [row[0] for row in connection.exec_driver_sql('EXPLAIN ' + statement, parameters)]
+        pattern = re.compile(r'Seq Scan on (\w+)')
+    scans = []
+    for line in plan:
+        match = pattern.search(line.strip().lstrip('->').strip())
+        table = match and (match.group(1) or match.group(match.lastindex))
+        if table and table_rows.get(table, 0) >= min_rows:
+            scans.append(table)
+    return plan, scans
+
+
+def run(args):
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'plans.db')
+    os.environ['DATABASE_URL'] = database_url
+    from sqlalchemy import event, func, select, text
+    import app as quiz_app
+    import metrics
+    from models import db, Admin, Quiz, Question, Answer, GameSession, Participant, ParticipantAnswer
+
+    with quiz_app.app.app_context():
+        print(f'Seeding {database_url}...')
+        admin_id, quiz_id = seed(db, (Admin, Quiz, Question, Answer, GameSession, Participant, ParticipantAnswer),
+                                 args.admins, args.quizzes, args.questions, args.games, args.players)
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        table_rows = {
+            table.name: db.session.execute(select(func.count()).select_from(table)).scalar()
+            for table in db.metadata.sorted_tables
+        }
+        engine = db.engine
+
+    statements = {}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if executemany or not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+            return
+        kind, handler = metrics._current_handler.get()
+        statements.setdefault((handler, statement), parameters)
+
+    event.listen(engine, 'before_cursor_execute', capture)
+    drive(quiz_app, admin_id, quiz_id, args.live_players)
+    event.remove(engine, 'before_cursor_execute', capture)
+
+    failures = 0
+    with engine.connect() as connection:
+        for (handler, statement), parameters in sorted(statements.items()):
+            plan, scans = full_scans(connection, statement, parameters, table_rows, args.min_rows)
+            status = 'FULL SCAN of ' + ', '.join(scans) if scans else 'ok'
+            failures += bool(scans)
+            summary = ' '.join(statement.split())
+            print(f'[{status}] {handler}: {summary[:140]}')
+            if scans or args.verbose:
+                for line in plan:
+                    print(f'    {line}')
+
+    print(f'\n{len(statements)} statements checked, {failures} with full scans')
+    return failures == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fail if hot-path queries fall back to full table scans.')
+    parser.add_argument('--database-url', help='Empty database to seed (default: temporary SQLite file)')
+    parser.add_argument('--admins', type=int, default=20)
+    parser.add_argument('--quizzes', type=int, default=20, help='Quizzes per admin')
+    parser.add_argument('--questions', type=int, default=10, help='Questions per quiz')
+    parser.add_argument('--games', type=int, default=400, help='Finished games to seed')
+    parser.add_argument('--players', type=int, default=10, help='Participants per seeded game')
+    parser.add_argument('--live-players', type=int, default=5, help='Players in the game that is played')
+    parser.add_argument('--min-rows', type=int, default=100, help='Ignore scans of tables smaller than this')
+    parser.add_argument('--verbose', action='store_true', help='Print every plan, not just failing ones')
+    sys.exit(0 if run(parser.parse_args()) else 1)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Multi-worker check: plays a game whose host and players are on different worker processes.
+
+Starts --workers copies of the app on consecutive ports, sharing one SQLite
+database and the built-in local message queue like the Procfile's gunicorn
+workers do. The host page that starts the game connects to the first worker,
+which then runs it, and the game is driven from a second host page on the
+last worker. Players are spread over all of them. Every player answers every
+question correctly, and the check fails (exit status 1) unless each of them
+got an acknowledgement and a correct answer_result for every answer, and
+ends with that score saved, on the leaderboard the host asks for, and in the
+personal leaderboards sent when the host shows them and when the game ends.
+
+Examples:
+    python check_workers.py
+    python check_workers.py --workers 4 --players 40
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import socketio
+
+from loadtest import create_game
+
+WORKER = '''
+import eventlet
+eventlet.monkey_patch()
+import eventlet.wsgi
+import app
+eventlet.wsgi.server(eventlet.listen(('127.0.0.1', {port})), app.app, log_output=False)
+'''
+
+
+def start_worker(port, env):
+    worker = subprocess.Popen(
+        [sys.executable, '-c', WORKER.format(port=port)], env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/').read()
+            return worker
+        except OSError:
+            if worker.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f'Worker on port {port} did not start')
+            eventlet.sleep(0.2)
+
+
+class Client:
+    """A Socket.IO connection that keeps every event it receives"""
+
+    def __init__(self, url):
+        self.events = []
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('*', lambda event, *args: self.events.append((event, args[0] if args else None)))
+        self.sio.connect(url, transports=['websocket'])
+
+    def received(self, event):
+        return [data for name, data in self.events if name == event]
+
+    def wait_for(self, event, count=1, timeout=10):
+        deadline = time.monotonic() + timeout
+        while len(self.received(event)) < count and time.monotonic() < deadline:
+            eventlet.sleep(0.05)
+        return self.received(event)
+
+
+class Player(Client):
+    def __init__(self, url, game_code, nickname, correct_answers):
+        super().__init__(url)
+        self.url = url
+        self.correct_answers = correct_answers
+        self.sio.on('show_question', self._answer)
+        self.sio.emit('join_game', {'game_code': game_code, 'nickname': nickname})
+        self.participant_id = self.wait_for('joined')[0]['participant_id']
+        joined = eventlet.event.Event()
+        self.sio.emit('join_room', {'game_code': game_code, 'participant_id': self.participant_id}, callback=lambda *args: joined.send())
+        joined.wait()
+
+    def _answer(self, question):
+        self.events.append(('show_question', question))
+        self.sio.emit('submit_answer', {
+            'participant_id': self.participant_id,
+            'question_id': question['question_id'],
+            'answer_ids': self.correct_answers[question['question_id']]
+        })
+
+
+def saved_scores(database_url):
+    from sqlalchemy import create_engine, text
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        return dict(connection.execute(text('SELECT participant_id, total_score FROM participants')).all())
+
+
+def run(args):
+    directory = tempfile.mkdtemp()
+    database_url = 'sqlite:///' + os.path.join(directory, 'workers.db')
+    env = dict(
+        os.environ, DATABASE_URL=database_url,
+        SOCKETIO_MESSAGE_QUEUE='local://' + os.path.join(directory, 'queue.sock')
+    )
+    urls = [f'http://127.0.0.1:{args.port + i}' for i in range(args.workers)]
+    # One at a time, so only the first creates the tables
+    workers = [start_worker(args.port + i, env) for i in range(args.workers)]
+    try:
+        return play(args, urls, database_url)
+    finally:
+        # The first worker relays the queue, so it goes last
+        for worker in reversed(workers):
+            worker.terminate()
+            worker.wait()
+
+
+def play(args, urls, database_url):
+    game_code = create_game(urls[0], args.questions, 4, args.time_limit)
+    owner = Client(urls[0])
+    owner.sio.emit('join_host_room', {'game_code': game_code})
+    owner.wait_for('quiz_data')
+    host = Client(urls[-1])
+    host.sio.emit('join_host_room', {'game_code': game_code})
+    questions = host.wait_for('quiz_data')[0]['questions']
+    correct_answers = {
+        question['question_id']: [answer['answer_id'] for answer in question['answers'] if answer['is_correct']]
+        for question in questions
+    }
+    players = [
+        Player(urls[i % len(urls)], game_code, f'player{i}', correct_answers) for i in range(args.players)
+    ]
+    print(f'Game {game_code}: run by {urls[0]}, hosted from {urls[-1]}, {args.players} players over {len(urls)} workers')
+
+    host.sio.emit('start_game', {'game_code': game_code})
+    for number, question in enumerate(questions, 1):
+        host.sio.emit('show_question', {'game_code': game_code, 'question': {'question_id': question['question_id']}})
+        host.wait_for('question_closed', number, timeout=args.time_limit + 10)
+        for player in players:
+            player.wait_for('answer_result', number)
+
+    host.sio.emit('get_leaderboard', {'game_code': game_code})
+    leaderboard = {
+        entry['participant_id']: entry['total_score'] for entry in host.wait_for('leaderboard_data')[0]['leaderboard']
+    }
+
+    host.sio.emit('broadcast_leaderboard', {'game_code': game_code})
+    host.sio.emit('end_game', {'game_code': game_code})
+    for player in players:
+        player.wait_for('game_ended')
+
+    failures = []
+    scores = saved_scores(database_url)
+    for player in players:
+        where = f'player {player.participant_id} on {player.url}'
+        acknowledged = [data['question_id'] for data in player.received('answer_received')]
+        results = player.received('answer_result')
+        errors = player.received('error')
+        if errors:
+            failures.append(f'{where} got errors: {errors}')
+        if sorted(acknowledged) != sorted(correct_answers):
+            failures.append(f'{where} had {len(acknowledged)} of {len(correct_answers)} answers acknowledged')
+        if len(results) != len(questions) or not all(result['correct'] and result['points_earned'] for result in results):
+            failures.append(f'{where} was not scored for every answer: {results}')
+        expected = sum(result['points_earned'] for result in results)
+        if scores.get(player.participant_id) != expected:
+            failures.append(f'{where} has {scores.get(player.participant_id)} points saved, expected {expected}')
+        if leaderboard.get(player.participant_id) != expected:
+            failures.append(f'{where} has {leaderboard.get(player.participant_id)} points on the leaderboard, expected {expected}')
+        for event in ('show_leaderboard', 'game_ended'):
+            boards = player.received(event)
+            me = boards[0].get('me') if boards else None
+            if len(boards) != 1 or me is None or me['participant_id'] != player.participant_id or me['total_score'] != expected:
+                failures.append(f'{where} got {event} {boards}, expected one showing {expected} points')
+
+    for client in [owner, host] + players:
+        client.sio.disconnect()
+
+    for failure in failures:
+        print('FAIL', failure)
+    print(f'{len(failures)} failures')
+    return not failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fail if a game does not work with players on several workers.')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=5070, help='Port of the first worker')
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--questions', type=int, default=2)
+    parser.add_argument('--time-limit', type=int, default=3, help='Seconds each question stays open')
+    sys.exit(0 if run(parser.parse_args()) else 1)
@@ -0,0 +1,491 @@
+"""
+Checkpoints of games being played, so a restarted worker can pick them up.
+
+A LiveGame only exists in the memory of one worker. Whenever a question opens
+or closes, and every few seconds while answers come in, the game is written
+to the game_checkpoints table as one compact binary blob: the question on
+screen and whether it is still open, each player's id, nickname, score and
+streak, who has answered each question, and the answers waiting to be
+graded. A worker that meets a game it holds no state for rebuilds it from
+the checkpoint and only loads the players who joined after it was taken,
+instead of reloading the participant and answer tables.
+
+Only one worker runs a game: the one holding the lease on its checkpoint row.
+The owner renews the lease as it saves, and is the only worker that writes
+the checkpoint or keeps a question open. Other workers may rebuild a copy of
+the game from the checkpoint, but only a worker taking over a lease that has
+run out resumes the question that was open. The owner also tells the other
+workers which games it runs every few seconds, and gives its leases up when
+it shuts down cleanly, so a worker whose pages are left on a game nobody
+runs takes it over as soon as the lease allows.
+
+Answers are only acknowledged once a checkpoint holding them is committed,
+so an acknowledged answer is graded even if its worker dies before the
+question closes. Games with acknowledgements waiting are saved within a
+short interval instead of on the next regular tick.
+"""
+
+import struct
+import sys
+import time
+import uuid
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert, or_, select, update
+
+import game_state
+from live_game import LiveGame
+from models import db, GameCheckpoint, Participant
+
+MAGIC = b'QGC2'
+# magic, saved at (unix time), question_id (0 before the first), question open,
+# seconds it had been open, number of players
+HEADER = struct.Struct('<4sdqBdI')
+# question_id, number of answered flags that follow
+ANSWERED = struct.Struct('<qI')
+# participant_id, seconds after the question opened, number of answer_ids
+SUBMISSION = struct.Struct('<qdH')
+LENGTH = struct.Struct('<H')
+COUNT = struct.Struct('<I')
+
+
+class Snapshot:
+    __slots__ = (
+        'saved_at', 'question_id', 'is_open', 'elapsed',
+        'participant_ids', 'scores', 'streaks', 'nicknames', 'answered_by_question', 'submissions'
+    )
+
+
+def _pack_column(typecode, values):
+    column = array(typecode, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _unpack_column(typecode, data, offset, count):
+    column = array(typecode)
+    end = offset + count * column.itemsize
+    column.frombytes(data[offset:end])
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column, end
+
+
+def encode(game, open_question=None):
+    """Serialise a game and its open question (if any) to bytes"""
+    is_open = open_question is not None
+    question_id = open_question.question_id if is_open else game.question_id
+    elapsed = time.monotonic() - open_question.opened_at if is_open else 0
+    parts = [
+        HEADER.pack(MAGIC, time.time(), question_id or 0, is_open, elapsed, len(game.participant_ids)),
+        _pack_column('q', game.participant_ids),
+        _pack_column('q', game.scores),
+        _pack_column('i', game.streaks)
+    ]
+    for nickname in game.nicknames:
+        encoded = nickname.encode('utf-8')
+        parts += [LENGTH.pack(len(encoded)), encoded]
+
+    parts.append(COUNT.pack(len(game.answered_by_question)))
+    for answered_question_id, answered in game.answered_by_question.items():
+        parts += [ANSWERED.pack(answered_question_id, len(answered)), bytes(answered)]
+
+    submissions = open_question.submissions if is_open else {}
+    parts.append(COUNT.pack(len(submissions)))
+    for participant_id, (answer_ids, seconds, _) in submissions.items():
+        parts += [SUBMISSION.pack(participant_id, seconds, len(answer_ids)), _pack_column('q', sorted(answer_ids))]
+    return zlib.compress(b''.join(parts), 1)
+
+
+def decode(blob):
+    data = zlib.decompress(blob)
+    magic, saved_at, question_id, is_open, elapsed, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('Not a game checkpoint')
+
+    snapshot = Snapshot()
+    snapshot.saved_at = saved_at
+    snapshot.question_id = question_id or None
+    snapshot.is_open = bool(is_open)
+    snapshot.elapsed = elapsed
+    offset = HEADER.size
+    snapshot.participant_ids, offset = _unpack_column('q', data, offset, count)
+    snapshot.scores, offset = _unpack_column('q', data, offset, count)
+    snapshot.streaks, offset = _unpack_column('i', data, offset, count)
+
+    snapshot.nicknames = []
+    for _ in range(count):
+        (length,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        snapshot.nicknames.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+
+    snapshot.answered_by_question = {}
+    (questions,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    for _ in range(questions):
+        answered_question_id, length = ANSWERED.unpack_from(data, offset)
+        offset += ANSWERED.size
+        snapshot.answered_by_question[answered_question_id] = bytearray(data[offset:offset + length])
+        offset += length
+
+    # participant_id -> (frozenset of answer_ids, seconds after opening, sid)
+    snapshot.submissions = {}
+    (submissions,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    for _ in range(submissions):
+        participant_id, seconds, answers = SUBMISSION.unpack_from(data, offset)
+        answer_ids, offset = _unpack_column('q', data, offset + SUBMISSION.size, answers)
+        # The player's old connection is gone; results go to whichever page they reconnect from
+        snapshot.submissions[participant_id] = (frozenset(answer_ids), seconds, None)
+    return snapshot
+
+
+def acquire_lease(game_session_id, owner, seconds):
+    """Take a game's lease if it is free, has run out or is already ``owner``'s.
+
+    Returns None once the lease is taken, otherwise the seconds left on the
+    lease of the worker holding it.
+    """
+    now = datetime.now(timezone.utc)
+    taken = db.session.execute(
+        update(GameCheckpoint).where(
+            GameCheckpoint.game_session_id == game_session_id,
+            or_(GameCheckpoint.owner.is_(None), GameCheckpoint.owner == owner, GameCheckpoint.lease_expires_at < now)
+        ).values(owner=owner, lease_expires_at=now + timedelta(seconds=seconds))
+    ).rowcount
+    if taken:
+        return None
+    held_until = db.session.execute(
+        select(GameCheckpoint.lease_expires_at).where(GameCheckpoint.game_session_id == game_session_id)
+    ).scalar()
+    if held_until is None:
+        # No checkpoint row yet; if another worker inserts one first, this insert fails instead
+        db.session.execute(insert(GameCheckpoint).values(
+            game_session_id=game_session_id, data=b'', owner=owner, lease_expires_at=now + timedelta(seconds=seconds)
+        ))
+        return None
+    return (held_until.replace(tzinfo=held_until.tzinfo or timezone.utc) - now).total_seconds()
+
+
+def renew_lease(game_session_id, owner, seconds):
+    """Extend ``owner``'s lease on a game, returning False if another worker has taken it"""
+    return db.session.execute(
+        update(GameCheckpoint).where(
+            GameCheckpoint.game_session_id == game_session_id, GameCheckpoint.owner == owner
+        ).values(lease_expires_at=datetime.now(timezone.utc) + timedelta(seconds=seconds))
+    ).rowcount > 0
+
+
+def save_checkpoint(game_session_id, data, owner, seconds):
+    """Store a game's checkpoint and renew ``owner``'s lease, returning False if the lease was lost"""
+    now = datetime.now(timezone.utc)
+    return db.session.execute(
+        update(GameCheckpoint).where(
+            GameCheckpoint.game_session_id == game_session_id, GameCheckpoint.owner == owner
+        ).values(data=data, saved_at=now, lease_expires_at=now + timedelta(seconds=seconds))
+    ).rowcount > 0
+
+
+def release_lease(game_session_id, owner):
+    """Give up ``owner``'s lease on a game so any worker may take it straight away"""
+    db.session.execute(
+        update(GameCheckpoint).where(
+            GameCheckpoint.game_session_id == game_session_id, GameCheckpoint.owner == owner
+        ).values(owner=None, lease_expires_at=None)
+    )
+
+
+def delete_checkpoint(game_session_id):
+    db.session.execute(delete(GameCheckpoint).where(GameCheckpoint.game_session_id == game_session_id))
+
+
+class Checkpointer:
+    """Saves live games through ``write``, rebuilds them from their checkpoints
+    and keeps the leases of the games this worker runs.
+
+    ``write(function, *args)`` must run the function in a transaction and
+    commit it, like the app's ``write_now``. Games passed to ``mark`` are
+    saved on the next tick, which comes ``answer_interval`` seconds later if
+    a callback is waiting for the save. Every ``interval`` seconds the leases
+    of owned games are renewed (by saving them if they changed) to last
+    ``lease`` seconds, so a game whose worker died can be taken over that
+    long after, and the games are announced on ``bus`` so other workers know
+    their owner is alive. A worker that finds a game held by an owner it no
+    longer hears from tries to take it over every ``interval`` seconds, for
+    as long as ``in_use(game_code)`` says one of its pages is connected here.
+    """
+
+    def __init__(self, socketio, app, scheduler, write, bus, in_use, interval=2.0, lease=10.0, answer_interval=0.05):
+        self.socketio = socketio
+        self.app = app
+        self.scheduler = scheduler
+        self.write = write
+        self.bus = bus
+        self.in_use = in_use
+        self.interval = interval
+        self.lease = lease
+        self.answer_interval = answer_interval
+        self.worker_id = uuid.uuid4().hex
+        # game_code -> game_session_id, for the games this worker runs
+        self.owned = {}
+        # game_code -> time.monotonic() until which another worker's lease is not checked again
+        self.held_elsewhere = {}
+        # game_code -> time.monotonic() until which another worker is taken to be running the game
+        self.heard_from = {}
+        # Games another worker holds that this one keeps trying to take over
+        self._retrying = set()
+        self._dirty = set()
+        # game_code -> callbacks to run once the game's next checkpoint is committed
+        self._on_saved = {}
+        # game_code -> callbacks of the checkpoint being written right now
+        self._saving = {}
+        self._save_now = None
+        self._task = None
+        bus.on('games_running')(self._note_running)
+
+    def owns(self, game_code):
+        return game_code in self.owned
+
+    def running_elsewhere(self, game_code):
+        """True if another worker said lately that it runs the game"""
+        return time.monotonic() < self.heard_from.get(game_code, 0)
+
+    def claim(self, game_code):
+        """True if this worker runs the game, taking it over if no other worker holds a live lease on it"""
+        if game_code in self.owned:
+            return True
+        if self.running_elsewhere(game_code) or time.monotonic() < self.held_elsewhere.get(game_code, 0):
+            return False
+        game_session_id = game_state.get_session_id(game_code)
+        if game_session_id is None:
+            return False
+        try:
+            held_for = self.write(acquire_lease, game_session_id, self.worker_id, self.lease)
+        except Exception:
+            # Most likely another worker created the lease at the same moment
+            self.app.logger.exception('Could not take the lease of game %s', game_code)
+            return False
+        if held_for is not None:
+            now = time.monotonic()
+            # A lease renewed lately means its owner is alive, as if it had been heard from
+            fresh_for = held_for - (self.lease - 2 * self.interval)
+            if fresh_for > 0:
+                self.heard_from[game_code] = max(self.heard_from.get(game_code, 0), now + fresh_for)
+            # Otherwise it may have stopped without giving the lease up, e.g. a worker
+            # restarted quicker than the lease runs out, so look again soon
+            self.held_elsewhere[game_code] = now + min(held_for, self.interval)
+            self._retry(game_code)
+            return False
+
+        self.held_elsewhere.pop(game_code, None)
+        self.heard_from.pop(game_code, None)
+        self.owned[game_code] = game_session_id
+        self._ensure_running()
+        # Any copy of the game this worker built before is older than the checkpoint
+        game_state.build_game(game_code)
+        self._announce()
+        return True
+
+    def forget(self, game_code):
+        """Drop what this worker knows about another worker's game once it has ended"""
+        self.held_elsewhere.pop(game_code, None)
+        self.heard_from.pop(game_code, None)
+        self._retrying.discard(game_code)
+
+    def mark(self, game_code, on_saved=None):
+        """Save the game on the next tick, then call ``on_saved()`` if given"""
+        if game_code not in self.owned:
+            return
+        self._dirty.add(game_code)
+        if on_saved is not None:
+            self._on_saved.setdefault(game_code, []).append(on_saved)
+            self._save_now.set()
+
+    def after_save(self, game_code, callback):
+        """Call ``callback()`` once everything marked so far is checkpointed, without marking the game again"""
+        if game_code not in self.owned:
+            return
+        if game_code in self._saving:
+            self._saving[game_code].append(callback)
+        elif game_code in self._dirty or game_code in self._on_saved:
+            self._on_saved.setdefault(game_code, []).append(callback)
+        else:
+            callback()
+
+    def save(self, game_code):
+        """Checkpoint a game right away"""
+        self._dirty.discard(game_code)
+        game = game_state.games.get(game_code)
+        if game is None or game_code not in self.owned:
+            return
+        # Callbacks added while this save is being written wait for the next one
+        callbacks = self._on_saved.pop(game_code, [])
+        # ... unless they only wait for what this save holds (see after_save)
+        self._saving[game_code] = callbacks
+        try:
+            saved = self.write(
+                save_checkpoint, game.game_session_id, encode(game, self.scheduler.open_questions.get(game_code)),
+                self.worker_id, self.lease
+            )
+        except Exception:
+            # The game carries on; it is only less recoverable until the next save
+            self.app.logger.exception('Checkpoint failed')
+            if callbacks:
+                self._on_saved[game_code] = callbacks + self._on_saved.get(game_code, [])
+                self._dirty.add(game_code)
+            return
+        finally:
+            self._saving.pop(game_code, None)
+        if not saved:
+            self._lose(game_code)
+            return
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                self.app.logger.exception('Checkpoint callback failed')
+
+    def discard(self, game_code, game_session_id):
+        """Drop the checkpoint (and lease) of a game that has ended"""
+        self._dirty.discard(game_code)
+        self._on_saved.pop(game_code, None)
+        self.owned.pop(game_code, None)
+        self.write(delete_checkpoint, game_session_id)
+
+    def release_all(self):
+        """Checkpoint the games this worker runs and give up their leases, for a clean shutdown.
+
+        Runs as the process exits, when the app's writer task may be gone, so
+        it commits here instead of going through ``write``.
+        """
+        with self.app.app_context():
+            for game_code, game_session_id in list(self.owned.items()):
+                game = game_state.games.get(game_code)
+                try:
+                    if game is not None:
+                        save_checkpoint(
+                            game_session_id, encode(game, self.scheduler.open_questions.get(game_code)),
+                            self.worker_id, self.lease
+                        )
+                    release_lease(game_session_id, self.worker_id)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Could not release the lease of game %s', game_code)
+        self.owned.clear()
+
+    def restore(self, game_code, game_session_id, answer_key, question_settings):
+        """A LiveGame rebuilt from the game's checkpoint, or None if it has none"""
+        data = db.session.execute(
+            select(GameCheckpoint.data).where(GameCheckpoint.game_session_id == game_session_id)
+        ).scalar()
+        if not data:
+            return None
+        try:
+            snapshot = decode(data)
+        except (ValueError, struct.error, zlib.error):
+            self.app.logger.exception('Unreadable checkpoint, rebuilding the game from the database')
+            return None
+
+        game = LiveGame(game_code, game_session_id, answer_key, question_settings)
+        for participant_id, nickname, score in zip(snapshot.participant_ids, snapshot.nicknames, snapshot.scores):
+            game.add_participant(participant_id, nickname, score)
+        game.streaks = snapshot.streaks
+        game.answered_by_question = snapshot.answered_by_question
+        if snapshot.question_id is not None:
+            game.open_question(snapshot.question_id)
+        else:
+            game.answered = bytearray(len(snapshot.participant_ids))
+
+        # Players who joined after the checkpoint was taken
+        rows = db.session.query(Participant.participant_id, Participant.nickname, Participant.total_score).filter(
+            Participant.game_session_id == game_session_id,
+            Participant.participant_id > max(snapshot.participant_ids, default=0)
+        ).all()
+        for participant_id, nickname, total_score in rows:
+            game.add_participant(participant_id, nickname, total_score or 0)
+
+        # Only the worker running the game keeps its question open
+        settings = question_settings.get(snapshot.question_id)
+        resume = game_code in self.owned and game_code not in self.scheduler.open_questions
+        if snapshot.is_open and settings is not None and resume:
+            time_limit, points = settings
+            # The clock kept running while no worker held the game
+            elapsed = snapshot.elapsed + max(time.time() - snapshot.saved_at, 0)
+            self.scheduler.resume(game_code, snapshot.question_id, time_limit, points, elapsed, snapshot.submissions)
+        return game
+
+    def _renew(self, game_code):
+        try:
+            renewed = self.write(renew_lease, self.owned[game_code], self.worker_id, self.lease)
+        except Exception:
+            self.app.logger.exception('Could not renew the lease of game %s', game_code)
+            return
+        if not renewed:
+            self._lose(game_code)
+
+    def _lose(self, game_code):
+        """Another worker took the game over after this one missed renewing its lease"""
+        self.app.logger.warning('Game %s is now run by another worker', game_code)
+        self.owned.pop(game_code, None)
+        self._dirty.discard(game_code)
+        # Answers since the last checkpoint are lost, so they are never acknowledged
+        self._on_saved.pop(game_code, None)
+        # The new owner resumed the question from the checkpoint, so it is not graded here
+        self.scheduler.open_questions.pop(game_code, None)
+        game_state.build_game(game_code)
+
+    def _announce(self):
+        if self.owned:
+            self.bus.publish('games_running', {'game_codes': list(self.owned)})
+
+    def _note_running(self, message):
+        # Announced every interval, so two missed in a row mean the owner has stopped
+        heard_until = time.monotonic() + 2 * self.interval
+        for game_code in message['game_codes']:
+            if game_code not in self.owned:
+                self.heard_from[game_code] = heard_until
+
+    def _retry(self, game_code):
+        if game_code not in self._retrying:
+            self._retrying.add(game_code)
+            self.socketio.start_background_task(self._take_over_when_free, game_code)
+
+    def _take_over_when_free(self, game_code):
+        while game_code in self._retrying:
+            self.socketio.sleep(self.interval)
+            with self.app.app_context():
+                if game_code in self.owned or not self.in_use(game_code) or game_state.get_session_id(game_code) is None:
+                    break
+                if not self.running_elsewhere(game_code) and self.claim(game_code):
+                    break
+        self._retrying.discard(game_code)
+
+    def _ensure_running(self):
+        if self._task is None:
+            self._save_now = self.socketio.server.eio.create_event()
+            self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        renew_at = time.monotonic() + self.interval
+        while True:
+            # Answers waiting to be acknowledged cut the wait short
+            if self._save_now.wait(max(renew_at - time.monotonic(), 0)):
+                # Give answers arriving together a moment to share one checkpoint
+                self.socketio.sleep(self.answer_interval)
+            self._save_now.clear()
+            renew = time.monotonic() >= renew_at
+            if renew:
+                renew_at = time.monotonic() + self.interval
+                self._announce()
+            dirty, self._dirty = self._dirty, set()
+            with self.app.app_context():
+                for game_code in list(self.owned):
+                    if game_code in dirty:
+                        self.save(game_code)
+                    elif renew:
+                        self._renew(game_code)
@@ -2,68 +2,167 @@
 """
 Cleanup script to remove duplicate answers from the database.
 This script identifies and removes answers that are duplicates based on question_id, answer_text, and is_correct.
+
+Duplicates are found with one window-function query. For each group the
+lowest answer_id is kept. Participant answers that point at a duplicate are
+moved to the kept answer, or deleted with --delete-dependents. Work is done
+in chunks with a commit after each, so locks are held only briefly and an
+interrupted run can simply be started again.
+
+Examples:
+    python cleanup_answers.py --dry-run
+    python cleanup_answers.py --chunk-size 500
 """
 
+import argparse
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, case, delete, exists, func, or_, select, update
+from sqlalchemy.orm import aliased
+
 from app import app, db
-from models import Answer, Question, ParticipantAnswer
+from models import Answer, Question, Quiz, ParticipantAnswer
+
+
+def duplicate_answers(limit=None):
+    """(duplicate answer_id, kept answer_id, question_id) for every duplicate answer"""
+    window = {
+        'partition_by': (Answer.question_id, Answer.answer_text, Answer.is_correct),
+        'order_by': Answer.answer_id
+    }
+    ranked = select(
+        Answer.answer_id,
+        Answer.question_id,
+        func.row_number().over(**window).label('position'),
+        func.first_value(Answer.answer_id).over(**window).label('keep_id')
+    ).subquery()
+    statement = select(ranked.c.answer_id, ranked.c.keep_id, ranked.c.question_id).where(
+        ranked.c.position > 1
+    ).order_by(ranked.c.answer_id)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return db.session.execute(statement)
+
+
+def remove_chunk(pairs, delete_dependents):
+    """Remove one chunk of duplicates, returning (repointed, deleted) participant answer counts"""
+    keep_for = {duplicate_id: keep_id for duplicate_id, keep_id, _ in pairs}
+    duplicate_ids = list(keep_for)
+    question_ids = {question_id for _, _, question_id in pairs}
+    repointed = 0
+
+    if delete_dependents:
+        deleted = db.session.execute(
+            delete(ParticipantAnswer).where(ParticipantAnswer.answer_id.in_(duplicate_ids))
+        ).rowcount
+    else:
+        # A participant who picked two copies of the same answer keeps only one row
+        group_of = {keep_id: keep_id for keep_id in keep_for.values()}
+        group_of.update(keep_for)
+        other = aliased(ParticipantAnswer)
+        deleted = db.session.execute(
+            delete(ParticipantAnswer).where(
+                ParticipantAnswer.answer_id.in_(duplicate_ids),
+                exists().where(and_(
+                    other.participant_id == ParticipantAnswer.participant_id,
+                    other.answer_id.in_(group_of.keys()),
+                    case(group_of, value=other.answer_id) == case(group_of, value=ParticipantAnswer.answer_id),
+                    # Prefer the row already on the kept answer, then the oldest
+                    or_(
+                        other.answer_id.notin_(duplicate_ids),
+                        other.participant_answer_id < ParticipantAnswer.participant_answer_id
+                    )
+                ))
+            ).execution_options(synchronize_session=False)
+        ).rowcount
+        repointed = db.session.execute(
+            update(ParticipantAnswer)
+            .where(ParticipantAnswer.answer_id.in_(duplicate_ids))
+            .values(answer_id=case(keep_for, value=ParticipantAnswer.answer_id))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    db.session.execute(delete(Answer).where(Answer.answer_id.in_(duplicate_ids)))
+
+    # Bump the affected quizzes so cached snapshots are rebuilt
+    db.session.execute(
+        update(Quiz)
+        .where(Quiz.quiz_id.in_(select(Question.quiz_id).where(Question.question_id.in_(question_ids))))
+        .values(updated_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    return repointed, deleted
 
-def cleanup_duplicate_answers():
+
+def report_duplicates(sample_size=20):
+    """Print what a cleanup would do without changing anything"""
+    answers = 0
+    questions = set()
+    duplicate_ids = []
+    samples = []
+    for duplicate_id, keep_id, question_id in duplicate_answers():
+        answers += 1
+        questions.add(question_id)
+        duplicate_ids.append(duplicate_id)
+        if len(samples) < sample_size:
+            samples.append((duplicate_id, keep_id, question_id))
+
+    dependents = 0
+    for start in range(0, len(duplicate_ids), 1000):
+        dependents += db.session.execute(
+            select(func.count()).select_from(ParticipantAnswer)
+            .where(ParticipantAnswer.answer_id.in_(duplicate_ids[start:start + 1000]))
+        ).scalar()
+
+    for duplicate_id, keep_id, question_id in samples:
+        print(f"  Question {question_id}: answer_id {duplicate_id} duplicates answer_id {keep_id}")
+    if answers > len(samples):
+        print(f"  ... and {answers - len(samples)} more")
+    print(f"\nWould remove {answers} duplicate answers across {len(questions)} questions "
+          f"({dependents} participant answers point at them).")
+
+
+def cleanup_duplicate_answers(chunk_size=1000, dry_run=False, delete_dependents=False):
     """Remove duplicate answers from the database"""
-    
+
     with app.app_context():
+        if dry_run:
+            print("Dry run: looking for duplicate answers...")
+            report_duplicates()
+            return True
+
         print("Starting cleanup of duplicate answers...")
-        
-        # Get all questions
-        questions = Question.query.all()
         total_deleted = 0
-        
-        for question in questions:
-            # Get all answers for this question
-            answers = Answer.query.filter_by(question_id=question.question_id).all()
-            
-            if len(answers) <= 1:
-                continue  # No duplicates possible
-            
-            # Group answers by text and correctness to find duplicates
-            answer_groups = {}
-            
-            for answer in answers:
-                key = (answer.answer_text, answer.is_correct)
-                if key not in answer_groups:
-                    answer_groups[key] = []
-                answer_groups[key].append(answer)
-            
-            # For each group with duplicates, keep the first one and delete the rest
-            for key, answer_list in answer_groups.items():
-                if len(answer_list) > 1:
-                    print(f"\nQuestion {question.question_id} ('{question.question_text[:50]}...'):")
-                    print(f"  Found {len(answer_list)} duplicates for: '{key[0]}' (Correct: {key[1]})")
-                    
-                    # Keep the first answer, delete the rest
-                    for answer_to_delete in answer_list[1:]:
-                        try:
-                            # Delete associated participant answers first
-                            ParticipantAnswer.query.filter_by(answer_id=answer_to_delete.answer_id).delete()
-                            print(f"    Deleted participant answers for answer_id {answer_to_delete.answer_id}")
-                            
-                            # Delete the answer
-                            db.session.delete(answer_to_delete)
-                            total_deleted += 1
-                            print(f"    Deleted duplicate answer_id {answer_to_delete.answer_id}")
-                        except Exception as e:
-                            print(f"    ERROR deleting answer_id {answer_to_delete.answer_id}: {str(e)}")
-                            db.session.rollback()
-                            return False
-        
-        try:
-            db.session.commit()
-            print(f"\n✓ Successfully deleted {total_deleted} duplicate answers!")
-            return True
-        except Exception as e:
-            db.session.rollback()
-            print(f"\n✗ Error committing changes: {str(e)}")
-            return False
+        total_repointed = 0
+        total_dependents_deleted = 0
+
+        while True:
+            # Removed rows drop out of the query, so each pass picks up the next chunk
+            pairs = duplicate_answers(limit=chunk_size).all()
+            if not pairs:
+                break
+            try:
+                repointed, deleted = remove_chunk(pairs, delete_dependents)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"\n✗ Error removing duplicates: {str(e)}")
+                return False
+            total_deleted += len(pairs)
+            total_repointed += repointed
+            total_dependents_deleted += deleted
+            print(f"  Removed {total_deleted} duplicate answers so far...")
+
+        print(f"\n✓ Successfully deleted {total_deleted} duplicate answers!")
+        print(f"  Participant answers repointed: {total_repointed}, deleted: {total_dependents_deleted}")
+        return True
 
 if __name__ == '__main__':
-    success = cleanup_duplicate_answers()
+    parser = argparse.ArgumentParser(description='Remove duplicate answers (same question, text and correctness).')
+    parser.add_argument('--dry-run', action='store_true', help='Report duplicates without changing anything')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Duplicates removed per transaction')
+    parser.add_argument('--delete-dependents', action='store_true',
+                        help='Delete participant answers that point at duplicates instead of moving them to the kept answer')
+    args = parser.parse_args()
+    success = cleanup_duplicate_answers(args.chunk_size, args.dry_run, args.delete_dependents)
     exit(0 if success else 1)
@@ -0,0 +1,94 @@
+"""
+Game code allocation.
+
+Codes are six characters of A-Z and 0-9. Instead of drawing random codes and
+hoping the database agrees they are unused, each process reserves a block of
+counter values with a single INSERT into ``game_code_blocks`` and turns every
+value into a code with a keyed permutation of the code space. Different
+counter values never share a code, so new codes need no lookup, and
+consecutive games don't get guessable neighbouring codes.
+
+The permutation is keyed by SECRET_KEY, which must be the same for every
+worker; changing it can only cause the rare collision the unique index still
+catches.
+"""
+
+import hashlib
+import string
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import insert
+
+from models import db, GameCodeBlock
+
+ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 6
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+
+
+class GameCodeAllocator:
+    """Hands out game codes that are unique among unfinished games.
+
+    With ``reuse_after`` set, codes of completed games are given out again
+    once that many seconds have passed, so late players of the old game don't
+    land in the new one. Reuse is only safe when the database requires codes
+    to be unique among unfinished games alone, and when no other worker may
+    still have the old game cached.
+    """
+
+    def __init__(self, secret, block_size=1000, reuse_after=None):
+        self.block_size = block_size
+        self.reuse_after = reuse_after
+        self._key = hashlib.sha256(secret.encode()).digest()
+        self._next = 0
+        self._end = 0
+        self._released = deque()  # (released at, code), oldest first
+        self._lock = threading.Lock()
+
+    def allocate(self):
+        with self._lock:
+            if self._released and time.monotonic() - self._released[0][0] >= self.reuse_after:
+                return self._released.popleft()[1]
+            if self._next == self._end:
+                block_id = self._reserve_block()
+                self._next = block_id * self.block_size
+                self._end = self._next + self.block_size
+            value = self._next
+            self._next += 1
+        return self.encode(self._permute(value % CODE_SPACE))
+
+    def release(self, code):
+        """Return the code of a game that has ended"""
+        if self.reuse_after is not None:
+            self._released.append((time.monotonic(), code))
+
+    def _reserve_block(self):
+        # Committed on its own connection: a rolled back request must not
+        # hand the same block to another worker
+        with db.engine.begin() as connection:
+            return connection.execute(insert(GameCodeBlock).returning(GameCodeBlock.block_id)).scalar()
+
+    def _round(self, number, half):
+        digest = hashlib.blake2b(bytes([number]) + half.to_bytes(2, 'big'), key=self._key, digest_size=2).digest()
+        return int.from_bytes(digest, 'big')
+
+    def _permute(self, value):
+        # A Feistel network permutes all 32-bit numbers; applying it until the
+        # result falls inside the code space permutes the code space itself
+        while True:
+            left, right = value >> 16, value & 0xFFFF
+            for number in range(4):
+                left, right = right, left ^ self._round(number, right)
+            value = (left << 16) | right
+            if value < CODE_SPACE:
+                return value
+
+    @staticmethod
+    def encode(value):
+        characters = []
+        for _ in range(CODE_LENGTH):
+            value, index = divmod(value, len(ALPHABET))
+            characters.append(ALPHABET[index])
+        return ''.join(reversed(characters))
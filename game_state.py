@@ -0,0 +1,146 @@
+"""
+In-memory state for games that are currently being played.
+
+Each game being played has a LiveGame here that handlers read and update
+directly; the database only receives the batched answer writes. Games are
+built when they start and rebuilt lazily on a miss, so a worker that
+restarts (or never saw the game start) still answers correctly after a
+couple of queries.
+"""
+
+from live_game import LiveGame
+from models import db, Quiz, GameSession, Participant
+import quiz_cache
+from socket_json import Encoded
+
+# game_code -> game_session_id, for unfinished games only since codes are reused
+session_ids = {}
+
+# game_code -> LiveGame
+games = {}
+
+# participant_id -> game_code
+participant_games = {}
+
+# Checkpointer that games are restored from, if the app set one up
+checkpoints = None
+
+
+def register_game(game_code, game_session_id):
+    session_ids[game_code] = game_session_id
+
+
+def get_session_id(game_code):
+    """The session id of the unfinished game with this code, or None if there is none"""
+    session_id = session_ids.get(game_code)
+    if session_id is None:
+        session_id = db.session.query(GameSession.game_session_id).filter(
+            GameSession.game_code == game_code, GameSession.status != 'completed'
+        ).scalar()
+        # Unknown codes are not cached, so bad input can't fill the registry
+        if session_id is not None:
+            session_ids[game_code] = session_id
+    return session_id
+
+
+def question_payload(question, number, total):
+    """What players are shown of a question: no answer key, just the answers to pick from"""
+    return Encoded({
+        'question_id': question['question_id'],
+        'question_number': number,
+        'total_questions': total,
+        'question_text': question['question_text'],
+        'time_limit': question['time_limit'] or 30,
+        'points': question['points'] or 100,
+        'answers': [{
+            'answer_id': answer['answer_id'],
+            'answer_text': answer['answer_text'],
+            'answer_order': answer['answer_order']
+        } for answer in question['answers']]
+    })
+
+
+def build_game(game_code):
+    """Compile a game's answer key and load its players, from its checkpoint if it has one"""
+    session_id = get_session_id(game_code)
+    quiz = session_id and Quiz.query.join(GameSession).filter(GameSession.game_session_id == session_id).first()
+    if not quiz:
+        return None
+
+    answer_key = {}
+    choices = {}
+    settings = {}
+    payloads = {}
+    questions = quiz_cache.get_snapshot(quiz).questions
+    for number, question in enumerate(questions, 1):
+        answer_key[question['question_id']] = frozenset(
+            answer['answer_id'] for answer in question['answers'] if answer['is_correct']
+        )
+        choices[question['question_id']] = frozenset(answer['answer_id'] for answer in question['answers'])
+        settings[question['question_id']] = (question['time_limit'] or 30, question['points'] or 100)
+        payloads[question['question_id']] = question_payload(question, number, len(questions))
+
+    game = checkpoints.restore(game_code, session_id, answer_key, settings) if checkpoints is not None else None
+    if game is None:
+        game = LiveGame(game_code, session_id, answer_key, settings)
+        rows = db.session.query(
+            Participant.participant_id, Participant.nickname, Participant.total_score
+        ).filter(Participant.game_session_id == session_id).all()
+        for participant_id, nickname, total_score in rows:
+            game.add_participant(participant_id, nickname, total_score or 0)
+    game.answer_choices = choices
+    game.question_payloads = payloads
+    for participant_id in game.participant_ids:
+        participant_games[participant_id] = game_code
+
+    # Player pages that connected before the rebuild are still there
+    previous = games.get(game_code)
+    if previous is not None:
+        game.sockets = previous.sockets
+    games[game_code] = game
+    return game
+
+
+def get_game(game_code):
+    """The LiveGame for a code, or None if no unfinished game has it"""
+    game = games.get(game_code)
+    if game is None:
+        game = build_game(game_code)
+    return game
+
+
+def register_participant(participant_id, game_code, nickname):
+    participant_games[participant_id] = game_code
+    game = games.get(game_code)
+    if game is not None:
+        game.add_participant(participant_id, nickname)
+
+
+def register_player_socket(game_code, participant_id, sid):
+    game = get_game(game_code)
+    if game is not None:
+        game.sockets[participant_id] = sid
+
+
+def game_code_for(participant_id):
+    game_code = participant_games.get(participant_id)
+    if game_code is None:
+        game_code = db.session.query(GameSession.game_code).join(Participant).filter(
+            Participant.participant_id == participant_id, GameSession.status != 'completed'
+        ).scalar()
+        if game_code is not None:
+            participant_games[participant_id] = game_code
+    return game_code
+
+
+def memory_samples():
+    """Metrics gauge: approximate bytes held per live game"""
+    return [('quiz_live_game_bytes', {'game': game_code}, game.memory_usage()) for game_code, game in games.items()]
+
+
+def forget_game(game_code):
+    """Drop all cached state for a game once it has ended"""
+    session_ids.pop(game_code, None)
+    games.pop(game_code, None)
+    for participant_id in [p for p, code in participant_games.items() if code == game_code]:
+        del participant_games[participant_id]
@@ -0,0 +1,89 @@
+"""
+Live leaderboard for a single game.
+"""
+
+import sys
+from array import array
+from bisect import bisect_left, insort
+
+
+def _key(participant_id, score):
+    # Sorting these integers ranks by score, highest first, then by participant_id
+    return -score * 2 ** 32 + participant_id
+
+
+class Leaderboard:
+    """Participant ids of one game kept in rank order as their scores change.
+
+    Each entry is a single integer packing (-score, participant_id), stored
+    in a list of sorted arrays, the layout sortedcontainers uses, so a score
+    change is two bisects plus a small in-bucket shift instead of a full
+    re-sort and an entry takes 8 bytes. Ties are ranked by participant_id,
+    i.e. whoever joined first. Scores themselves live with the caller, which
+    passes them in.
+    """
+    BUCKET_SIZE = 256
+
+    def __init__(self):
+        self._buckets = []
+        self._maxes = []
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, participant_id, score):
+        self._insert(_key(participant_id, score))
+        self._size += 1
+
+    def move(self, participant_id, old_score, new_score):
+        self._remove(_key(participant_id, old_score))
+        self._insert(_key(participant_id, new_score))
+
+    def rank(self, participant_id, score):
+        """1-based rank of a participant with the given score"""
+        key = _key(participant_id, score)
+        i = bisect_left(self._maxes, key)
+        return sum(len(b) for b in self._buckets[:i]) + bisect_left(self._buckets[i], key) + 1
+
+    def slice(self, start, stop=None):
+        """(participant_id, score) pairs between two 0-based ranks"""
+        entries = []
+        skipped = 0
+        for bucket in self._buckets:
+            if skipped + len(bucket) <= start:
+                skipped += len(bucket)
+                continue
+            for key in bucket[max(start - skipped, 0):]:
+                if stop is not None and start + len(entries) >= stop:
+                    return entries
+                entries.append((key & 0xFFFFFFFF, -(key >> 32)))
+            skipped += len(bucket)
+        return entries
+
+    def memory_usage(self):
+        """Approximate bytes held by the leaderboard"""
+        return sum(map(sys.getsizeof, self._buckets)) + sys.getsizeof(self._buckets) + sys.getsizeof(self._maxes)
+
+    def _insert(self, key):
+        if not self._buckets:
+            self._buckets.append(array('q', [key]))
+            self._maxes.append(key)
+            return
+        i = min(bisect_left(self._maxes, key), len(self._buckets) - 1)
+        bucket = self._buckets[i]
+        insort(bucket, key)
+        self._maxes[i] = bucket[-1]
+        if len(bucket) > 2 * self.BUCKET_SIZE:
+            self._buckets[i:i + 1] = [bucket[:self.BUCKET_SIZE], bucket[self.BUCKET_SIZE:]]
+            self._maxes[i:i + 1] = [bucket[self.BUCKET_SIZE - 1], bucket[-1]]
+
+    def _remove(self, key):
+        i = bisect_left(self._maxes, key)
+        bucket = self._buckets[i]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[i] = bucket[-1]
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
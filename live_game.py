@@ -0,0 +1,151 @@
+"""
+State of one game while it is being played.
+"""
+
+import sys
+from array import array
+
+from leaderboard import Leaderboard
+
+
+class LiveGame:
+    """Everything a worker needs to run a game without going to the database.
+
+    Each participant gets a slot when they join. Ids, scores and streaks are
+    kept in parallel arrays indexed by slot, and every question has a
+    bytearray with one byte per slot saying who has answered it, which makes
+    "has this player answered this question" an O(1) check without a set of
+    (participant_id, question_id) pairs. A 1,000 player game takes
+    about 160 KB, most of it nicknames and the id to slot lookup, instead of
+    an object per player.
+    """
+    __slots__ = (
+        'game_code', 'game_session_id', 'answer_key', 'answer_choices', 'question_settings', 'question_payloads',
+        'question_id',
+        'slots', 'participant_ids', 'nicknames', 'scores', 'streaks', 'answered', 'answered_by_question',
+        'sockets', 'leaderboard'
+    )
+
+    def __init__(self, game_code, game_session_id, answer_key, question_settings):
+        self.game_code = game_code
+        self.game_session_id = game_session_id
+        # question_id -> frozenset of correct answer_ids
+        self.answer_key = answer_key
+        # question_id -> frozenset of every answer_id players may pick
+        self.answer_choices = {}
+        # question_id -> (time_limit, points)
+        self.question_settings = question_settings
+        # question_id -> socket_json.Encoded show_question payload for players
+        self.question_payloads = {}
+        # The question on screen, or None before the first one
+        self.question_id = None
+
+        # participant_id -> slot in the columns below
+        self.slots = {}
+        self.participant_ids = array('q')
+        self.nicknames = []
+        self.scores = array('q')
+        self.streaks = array('i')
+        # Answered flags of the question on screen, one of answered_by_question
+        self.answered = bytearray()
+        # question_id -> answered flags by slot; players who joined later may be past the end
+        self.answered_by_question = {}
+
+        # participant_id -> sid of the player's game page
+        self.sockets = {}
+        self.leaderboard = Leaderboard()
+
+    def __contains__(self, participant_id):
+        return participant_id in self.slots
+
+    def add_participant(self, participant_id, nickname, score=0):
+        if participant_id in self.slots:
+            return
+        self.slots[participant_id] = len(self.participant_ids)
+        self.participant_ids.append(participant_id)
+        self.nicknames.append(nickname)
+        self.scores.append(score)
+        self.streaks.append(0)
+        self.answered.append(0)
+        self.leaderboard.insert(participant_id, score)
+
+    def score(self, participant_id):
+        slot = self.slots.get(participant_id)
+        return None if slot is None else self.scores[slot]
+
+    def streak(self, participant_id):
+        slot = self.slots.get(participant_id)
+        return None if slot is None else self.streaks[slot]
+
+    def open_question(self, question_id):
+        self.question_id = question_id
+        # A question shown again keeps the flags of those who already answered it
+        answered = self.answered_by_question.setdefault(question_id, bytearray())
+        answered.extend(bytes(len(self.participant_ids) - len(answered)))
+        self.answered = answered
+
+    def has_answered(self, participant_id, question_id):
+        slot = self.slots.get(participant_id)
+        answered = self.answered_by_question.get(question_id)
+        return slot is not None and answered is not None and slot < len(answered) and answered[slot] == 1
+
+    def mark_answered(self, participant_id):
+        """Flag an answer to the question on screen"""
+        slot = self.slots.get(participant_id)
+        if slot is not None:
+            self.answered[slot] = 1
+
+    def record_result(self, participant_id, correct, points):
+        """Apply a graded answer to the participant's score and streak"""
+        slot = self.slots.get(participant_id)
+        if slot is None:
+            return
+        self.answered[slot] = 1
+        self.streaks[slot] = self.streaks[slot] + 1 if correct else 0
+        if points:
+            old_score = self.scores[slot]
+            self.scores[slot] = old_score + points
+            self.leaderboard.move(participant_id, old_score, old_score + points)
+
+    def set_score(self, participant_id, score):
+        """Take a score the worker grading the game's answers worked out"""
+        slot = self.slots.get(participant_id)
+        if slot is None or self.scores[slot] == score:
+            return
+        old_score = self.scores[slot]
+        self.scores[slot] = score
+        self.leaderboard.move(participant_id, old_score, score)
+
+    def close_question(self):
+        """Break the streak of everyone who let the question pass"""
+        for slot, answered in enumerate(self.answered):
+            if not answered:
+                self.streaks[slot] = 0
+
+    def rank(self, participant_id):
+        """1-based rank of a participant, or None if they are not playing"""
+        slot = self.slots.get(participant_id)
+        return None if slot is None else self.leaderboard.rank(participant_id, self.scores[slot])
+
+    def top(self, n=None):
+        """The first n leaderboard entries (all of them if n is None) as dicts"""
+        return self.slice(0, n)
+
+    def slice(self, start, stop=None):
+        """Leaderboard entries between two 0-based ranks as dicts"""
+        return [{
+            'participant_id': participant_id,
+            'nickname': self.nicknames[self.slots[participant_id]],
+            'total_score': score
+        } for participant_id, score in self.leaderboard.slice(start, stop)]
+
+    def memory_usage(self):
+        """Approximate bytes held for the game's participants"""
+        columns = (self.slots, self.participant_ids, self.nicknames, self.scores, self.streaks)
+        return (
+            sum(map(sys.getsizeof, columns)) + sum(map(sys.getsizeof, self.slots))
+            + sys.getsizeof(self.answered_by_question) + sum(map(sys.getsizeof, self.answered_by_question.values()))
+            + sum(map(sys.getsizeof, self.nicknames))
+            + sys.getsizeof(self.sockets) + sum(map(sys.getsizeof, self.sockets.values()))
+            + self.leaderboard.memory_usage()
+        )
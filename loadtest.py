@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Load generator that plays a whole game against the server with simulated players.
+
+It creates an admin, a quiz and a game through the REST API, then drives the
+Socket.IO events a real game uses: a join storm (join_game + join_room), one
+show_question broadcast and answer burst (submit_answer) per question, and a
+get_leaderboard after each question. Per phase it reports event latency
+percentiles, events/sec and DB query counts. Query counts are read from the
+server's /metrics endpoint when testing a running server; with several
+workers that only covers the worker answering the scrape.
+
+Examples:
+    python loadtest.py --players 1000                  # in-process server on SQLite
+    python loadtest.py --players 500 --database-url postgresql://localhost/quiz_load
+    python loadtest.py --url http://localhost:5000     # server that is already running
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import urllib.request
+
+import socketio
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+class Phase:
+    """Latencies and query counts for one part of the game"""
+
+    def __init__(self, name, query_counter):
+        self.name = name
+        self.query_counter = query_counter
+        self.latencies = {}
+        self.started = None
+        self.finished = None
+        self.queries = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self._queries_at_start = self.query_counter() if self.query_counter else None
+        return self
+
+    def __exit__(self, *exc):
+        self.finished = time.perf_counter()
+        if self.query_counter:
+            self.queries = self.query_counter() - self._queries_at_start
+
+    def record(self, event, seconds):
+        self.latencies.setdefault(event, []).append(seconds)
+
+    def report(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        rows = []
+        for event, latencies in self.latencies.items():
+            rows.append((
+                self.name, event, len(latencies), elapsed,
+                len(latencies) / elapsed if elapsed else 0.0,
+                percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+                self.queries
+            ))
+        return rows
+
+
+def api(url, path, payload):
+    request = urllib.request.Request(
+        url + path, data=json.dumps(payload).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}, method='POST'
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def create_game(url, questions, answers, time_limit):
+    """Register a throwaway admin and quiz, and open a game session for it"""
+    tag = f'load{int(time.time() * 1000)}{random.randint(0, 9999)}'
+    admin = api(url, '/api/register', {'username': tag, 'email': f'{tag}@loadtest.local', 'password': tag})
+    admin_id = admin['admin_id']
+    quiz_id = api(url, '/api/quiz', {'admin_id': admin_id, 'title': f'Load test {tag}'})['quiz_id']
+    for order in range(questions):
+        api(url, f'/api/quiz/{quiz_id}/question', {
+            'admin_id': admin_id,
+            'question_text': f'Question {order + 1}',
+            'question_order': order,
+            'time_limit': time_limit,
+            'points': 100,
+            'answers': [{
+                'answer_text': f'Answer {i + 1}',
+                'is_correct': i == 0,
+                'answer_order': i
+            } for i in range(answers)]
+        })
+    game = api(url, '/api/game/start', {'quiz_id': quiz_id, 'admin_id': admin_id})
+    return game['game_code']
+
+
+class Player:
+    def __init__(self, url, game_code, nickname, answer_window):
+        self.url = url
+        self.game_code = game_code
+        self.nickname = nickname
+        self.answer_window = answer_window
+        self.participant_id = None
+        self.phase = None
+        self.question_shown_at = None
+        self._joined = eventlet.event.Event()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('joined', self._on_joined)
+        self.sio.on('show_question', self._on_show_question)
+        self.sio.on('answer_received', self._on_answer_received)
+        self._submitted_at = None
+
+    def join(self, phase):
+        self.phase = phase
+        self.sio.connect(self.url, transports=['websocket'])
+        sent = time.perf_counter()
+        self.sio.emit('join_game', {'game_code': self.game_code, 'nickname': self.nickname})
+        self._joined.wait()
+        phase.record('join_game', time.perf_counter() - sent)
+
+        room_joined = eventlet.event.Event()
+        sent = time.perf_counter()
+        self.sio.emit('join_room', {'game_code': self.game_code, 'participant_id': self.participant_id},
+                      callback=lambda *args: room_joined.send())
+        room_joined.wait()
+        phase.record('join_room', time.perf_counter() - sent)
+
+    def _on_joined(self, data):
+        self.participant_id = data['participant_id']
+        self._joined.send()
+
+    def _on_show_question(self, data):
+        self.phase.record('show_question (fan-out)', time.perf_counter() - self.question_shown_at)
+        eventlet.spawn(self._answer, data)
+
+    def _answer(self, question):
+        eventlet.sleep(random.uniform(0, self.answer_window))
+        answer = random.choice(question['answers'])
+        self._submitted_at = time.perf_counter()
+        self.sio.emit('submit_answer', {
+            'participant_id': self.participant_id,
+            'question_id': question['question_id'],
+            'answer_ids': [answer['answer_id']]
+        })
+
+    def _on_answer_received(self, data):
+        self.phase.record('submit_answer', time.perf_counter() - self._submitted_at)
+
+
+class Host:
+    def __init__(self, url, game_code):
+        self.game_code = game_code
+        self.questions = []
+        self._quiz_data = eventlet.event.Event()
+        self._closed = None
+        self._leaderboard = None
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('quiz_data', self._on_quiz_data)
+        self.sio.on('question_closed', lambda data: self._closed.send())
+        self.sio.on('leaderboard_data', lambda data: self._leaderboard.send(data))
+        self.sio.connect(url, transports=['websocket'])
+        self.sio.emit('join_host_room', {'game_code': game_code})
+        self._quiz_data.wait()
+
+    def _on_quiz_data(self, data):
+        self.questions = data['questions']
+        self._quiz_data.send()
+
+    def show_question(self, index):
+        question = self.questions[index]
+        self._closed = eventlet.event.Event()
+        self.sio.emit('show_question', {'game_code': self.game_code, 'question': {'question_id': question['question_id']}})
+
+    def wait_for_close(self):
+        self._closed.wait()
+
+    def get_leaderboard(self):
+        self._leaderboard = eventlet.event.Event()
+        self.sio.emit('get_leaderboard', {'game_code': self.game_code})
+        return self._leaderboard.wait()
+
+
+def start_local_server(database_url, port):
+    """Run the app in this process so its SQL statements can be counted"""
+    os.environ['DATABASE_URL'] = database_url
+    import eventlet.wsgi
+    from sqlalchemy import event
+    import app as quiz_app
+    from models import db
+
+    counter = {'queries': 0}
+
+    def count_query(*args):
+        counter['queries'] += 1
+
+    with quiz_app.app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+    listener = eventlet.listen(('127.0.0.1', port))
+    eventlet.spawn(eventlet.wsgi.server, listener, quiz_app.app, log_output=False)
+    return lambda: counter['queries']
+
+
+def metrics_query_counter(url):
+    """Total SQL statements reported by a running server's /metrics endpoint"""
+    def count():
+        with urllib.request.urlopen(url + '/metrics') as response:
+            text = response.read().decode('utf-8')
+        return int(sum(
+            float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+            if line.startswith('quiz_sql_statements_total')
+        ))
+    return count
+
+
+def run(args):
+    url = args.url
+    if url is not None:
+        query_counter = metrics_query_counter(url)
+    else:
+        database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'loadtest.db')
+        query_counter = start_local_server(database_url, args.port)
+        url = f'http://127.0.0.1:{args.port}'
+        print(f'Started in-process server on {url} using {database_url}')
+
+    game_code = create_game(url, args.questions, args.answers, args.time_limit)
+    print(f'Game {game_code}: {args.players} players, {args.questions} questions')
+    host = Host(url, game_code)
+    players = [Player(url, game_code, f'player{i}', args.answer_window) for i in range(args.players)]
+    phases = []
+
+    with Phase('join', query_counter) as phase:
+        pool = eventlet.GreenPool(args.concurrency)
+        for player in players:
+            pool.spawn(player.join, phase)
+            if args.join_window:
+                eventlet.sleep(args.join_window / args.players)
+        pool.waitall()
+    phases.append(phase)
+
+    host.sio.emit('start_game', {'game_code': game_code})
+    for index in range(args.questions):
+        with Phase(f'question {index + 1}', query_counter) as phase:
+            now = time.perf_counter()
+            for player in players:
+                player.phase = phase
+                player.question_shown_at = now
+            host.show_question(index)
+            host.wait_for_close()
+        phases.append(phase)
+
+        with Phase(f'leaderboard {index + 1}', query_counter) as phase:
+            sent = time.perf_counter()
+            host.get_leaderboard()
+            phase.record('get_leaderboard', time.perf_counter() - sent)
+        phases.append(phase)
+
+    host.sio.emit('end_game', {'game_code': game_code})
+    eventlet.sleep(0.5)
+    for client in [host] + players:
+        client.sio.disconnect()
+
+    header = ('phase', 'event', 'count', 'wall s', 'events/s', 'p50 ms', 'p99 ms', 'db queries')
+    print()
+    print('{:<15} {:<24} {:>7} {:>8} {:>10} {:>9} {:>9} {:>11}'.format(*header))
+    for phase in phases:
+        for row in phase.report():
+            name, event, count, elapsed, rate, p50, p99, queries = row
+            print('{:<15} {:<24} {:>7} {:>8.2f} {:>10.1f} {:>9.1f} {:>9.1f} {:>11}'.format(
+                name, event, count, elapsed, rate, p50, p99, 'n/a' if queries is None else queries
+            ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate a live game with many players.')
+    parser.add_argument('--url', help='Server to test (default: start one in-process)')
+    parser.add_argument('--database-url', help='Database for the in-process server (default: temporary SQLite file)')
+    parser.add_argument('--port', type=int, default=5055, help='Port for the in-process server')
+    parser.add_argument('--players', type=int, default=200)
+    parser.add_argument('--questions', type=int, default=3)
+    parser.add_argument('--answers', type=int, default=4, help='Answers per question')
+    parser.add_argument('--time-limit', type=int, default=5, help='Seconds each question stays open')
+    parser.add_argument('--answer-window', type=float, default=2.0,
+                        help='Players answer at a random time within this many seconds of the question')
+    parser.add_argument('--join-window', type=float, default=0.0,
+                        help='Spread joins over this many seconds (0 joins everyone at once)')
+    parser.add_argument('--concurrency', type=int, default=1000, help='Max players connecting at the same time')
+    run(parser.parse_args())
@@ -0,0 +1,165 @@
+"""
+Local pub/sub backend for Flask-SocketIO.
+
+Lets several worker processes on the same host share Socket.IO rooms without
+an external broker. Whichever process holds the lock file relays frames over a
+Unix socket, and every process (the relaying one included) connects to it as a
+normal client. If the relaying process dies its lock is released and the next
+worker to reconnect takes over.
+"""
+
+import fcntl
+import os
+import socket
+import struct
+from urllib.parse import urlparse
+
+from engineio import json
+from socketio import PubSubManager
+
+# Frames are a 4-byte big-endian length followed by the JSON payload
+_HEADER = struct.Struct('!I')
+
+# First byte sent on a new connection, so the broker knows who to fan out to
+_ROLE_PUBLISHER = b'P'
+_ROLE_SUBSCRIBER = b'S'
+
+
+def _recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError('Message queue connection closed')
+        buf += chunk
+    return bytes(buf)
+
+
+def _read_frame(sock):
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return _recv_exact(sock, size)
+
+
+class LocalSocketManager(PubSubManager):
+    """Client manager that shares events between processes over a Unix socket.
+
+    Use it by setting ``SOCKETIO_MESSAGE_QUEUE=local:///path/to/queue.sock``.
+    """
+    name = 'local'
+
+    def __init__(self, url='local:///tmp/quiz-socketio.sock', channel='socketio',
+                 write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = urlparse(url).path
+        self._lock_file = None
+        self._subscribers = []
+        self._fanout = None
+        self._outbox = None
+
+    def initialize(self):
+        if self.server.async_mode == 'eventlet':
+            from eventlet.patcher import is_monkey_patched
+            if not is_monkey_patched('socket'):
+                raise RuntimeError('The local message queue requires a monkey '
+                                   'patched socket library to work with eventlet')
+        self._outbox = self.server.eio.create_queue()
+        self.server.start_background_task(self._publish_loop)
+        super().initialize()
+
+    def _publish(self, data):
+        self._outbox.put(json.dumps(data).encode('utf-8'))
+
+    def _listen(self):
+        while True:
+            sock = self._connect(_ROLE_SUBSCRIBER)
+            try:
+                while True:
+                    yield _read_frame(sock)
+            except OSError:
+                self._get_logger().error('Lost connection to local message '
+                                         'queue, reconnecting')
+            finally:
+                sock.close()
+
+    def _publish_loop(self):
+        sock = None
+        while True:
+            frame = self._outbox.get()
+            # One retry covers a broker handover; after that the event is dropped
+            for _ in range(2):
+                try:
+                    if sock is None:
+                        sock = self._connect(_ROLE_PUBLISHER)
+                    sock.sendall(_HEADER.pack(len(frame)) + frame)
+                    break
+                except OSError:
+                    if sock is not None:
+                        sock.close()
+                    sock = None
+            else:
+                self._get_logger().error('Cannot publish to local message '
+                                         'queue... giving up')
+
+    def _connect(self, role):
+        """Connect to the broker, becoming the broker first if nobody is"""
+        while True:
+            self._try_become_broker()
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                sock.sendall(role)
+                return sock
+            except OSError:
+                sock.close()
+                self.server.sleep(0.5)
+
+    def _try_become_broker(self):
+        if self._lock_file is not None:
+            return
+        lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return
+        self._lock_file = lock_file
+
+        # Whoever held the lock before us is gone, so the socket file is stale
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen(128)
+        self._fanout = self.server.eio.create_queue()
+        self.server.start_background_task(self._broker_accept, listener)
+        self.server.start_background_task(self._broker_fanout)
+        self._get_logger().info('Local message queue broker listening on '
+                                + self.path)
+
+    def _broker_accept(self, listener):
+        while True:
+            conn, _ = listener.accept()
+            self.server.start_background_task(self._broker_serve, conn)
+
+    def _broker_serve(self, conn):
+        try:
+            role = _recv_exact(conn, 1)
+            if role == _ROLE_SUBSCRIBER:
+                self._subscribers.append(conn)
+                return
+            while True:
+                frame = _read_frame(conn)
+                self._fanout.put(_HEADER.pack(len(frame)) + frame)
+        except OSError:
+            conn.close()
+
+    def _broker_fanout(self):
+        # A single task writes to every subscriber so frames never interleave
+        while True:
+            data = self._fanout.get()
+            for conn in list(self._subscribers):
+                try:
+                    conn.sendall(data)
+                except OSError:
+                    self._subscribers.remove(conn)
+                    conn.close()
@@ -0,0 +1,178 @@
+"""
+Lightweight instrumentation for Socket.IO handlers, Flask routes and SQL.
+
+Recording is a few dictionary updates per event; nothing is formatted until
+someone scrapes ``/metrics``, which renders the Prometheus text format.
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+import time
+
+from flask import Response, g, request
+from sqlalchemy import event
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Handler whose work is currently running, so SQL can be attributed to it
+_current_handler = ContextVar('current_handler', default=('background', 'background'))
+
+
+class Histogram:
+    __slots__ = ('buckets', 'count', 'sum')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+# (kind, handler) -> Histogram
+handler_latency = defaultdict(Histogram)
+
+# (metric name, sorted label items) -> value
+counters = defaultdict(float)
+
+# Callables returning [(metric name, labels dict, value)] evaluated on scrape
+gauges = []
+
+
+def increment(name, value=1, **labels):
+    counters[(name, tuple(sorted(labels.items())))] += value
+
+
+def observe_handler(kind, handler, seconds):
+    handler_latency[(kind, handler)].observe(seconds)
+
+
+def _wrap_socketio_handler(event_name, handler):
+    label = ('socketio', event_name)
+
+    def instrumented(*args):
+        token = _current_handler.set(label)
+        started = time.perf_counter()
+        try:
+            return handler(*args)
+        finally:
+            observe_handler('socketio', event_name, time.perf_counter() - started)
+            _current_handler.reset(token)
+
+    return instrumented
+
+
+# Rooms are host_<game code>, player_<participant id>, or a game code
+ROOM_KINDS = ('game', 'host', 'player')
+
+
+def room_kind(room):
+    prefix = room.partition('_')[0]
+    return prefix if prefix in ROOM_KINDS else 'game'
+
+
+def instrument_socketio(socketio):
+    """Time every registered Socket.IO handler and report room sizes.
+
+    Call this after all ``@socketio.on`` handlers have been defined.
+    """
+    for namespace_handlers in socketio.server.handlers.values():
+        for event_name, handler in list(namespace_handlers.items()):
+            namespace_handlers[event_name] = _wrap_socketio_handler(event_name, handler)
+
+    def room_sizes():
+        rooms = socketio.server.manager.rooms.get('/', {})
+        connected = len(rooms.get(None, {}))
+        # Totals per kind of room rather than per room, since every player gets a room of their own
+        room_counts = dict.fromkeys(ROOM_KINDS, 0)
+        member_counts = dict.fromkeys(ROOM_KINDS, 0)
+        for room, members in rooms.items():
+            # Every client also sits in a private room named after its sid
+            if room is None or room in members:
+                continue
+            kind = room_kind(room)
+            room_counts[kind] += 1
+            member_counts[kind] += len(members)
+        return (
+            [('quiz_socketio_connected_clients', {}, connected)]
+            + [('quiz_socketio_rooms', {'kind': kind}, room_counts[kind]) for kind in ROOM_KINDS]
+            + [('quiz_socketio_room_members', {'kind': kind}, member_counts[kind]) for kind in ROOM_KINDS]
+        )
+
+    gauges.append(room_sizes)
+
+
+def instrument_flask(app):
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+        g._metrics_token = _current_handler.set(('http', request.endpoint or 'unknown'))
+
+    @app.teardown_request
+    def _stop_timer(exc):
+        started = g.pop('_metrics_started', None)
+        token = g.pop('_metrics_token', None)
+        if started is not None:
+            observe_handler('http', request.endpoint or 'unknown', time.perf_counter() - started)
+        if token is not None:
+            _current_handler.reset(token)
+
+
+def instrument_engine(engine):
+    """Count SQL statements and their time per handler"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metrics_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['_metrics_started'].pop()
+        kind, handler = _current_handler.get()
+        increment('quiz_sql_statements_total', kind=kind, handler=handler)
+        increment('quiz_sql_seconds_total', elapsed, kind=kind, handler=handler)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    items = labels.items() if isinstance(labels, dict) else labels
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in items) + '}'
+
+
+def render():
+    lines = ['# TYPE quiz_handler_seconds histogram']
+    for (kind, handler), histogram in sorted(handler_latency.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram.buckets):
+            cumulative += count
+            labels = _format_labels({'kind': kind, 'handler': handler, 'le': bound})
+            lines.append(f'quiz_handler_seconds_bucket{labels} {cumulative}')
+        labels = _format_labels({'kind': kind, 'handler': handler})
+        lines.append(f'quiz_handler_seconds_sum{labels} {histogram.sum}')
+        lines.append(f'quiz_handler_seconds_count{labels} {histogram.count}')
+
+    typed = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typed:
+            lines.append(f'# TYPE {name} counter')
+            typed.add(name)
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    for collect in gauges:
+        for name, labels, value in collect():
+            if name not in typed:
+                lines.append(f'# TYPE {name} gauge')
+                typed.add(name)
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_response():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
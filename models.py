@@ -1,4 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone
 
 db = SQLAlchemy()
@@ -20,7 +22,7 @@ class Quiz(db.Model):
     __tablename__ = 'quizzes'
     
     quiz_id = db.Column(db.Integer, primary_key=True)
-    admin_id = db.Column(db.Integer, db.ForeignKey('admin.admin_id'), nullable=False)
+    admin_id = db.Column(db.Integer, db.ForeignKey('admin.admin_id'), nullable=False, index=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
@@ -34,7 +36,7 @@ class Question(db.Model):
     __tablename__ = 'questions'
     
     question_id = db.Column(db.Integer, primary_key=True)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.quiz_id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.quiz_id'), nullable=False, index=True)
     question_text = db.Column(db.Text, nullable=False)
     question_order = db.Column(db.Integer, nullable=False)
     time_limit = db.Column(db.Integer, default=30)
@@ -46,6 +48,8 @@ class Question(db.Model):
 
 class Answer(db.Model):
     __tablename__ = 'answers'
+    # Also serves lookups by question_id alone
+    __table_args__ = (db.Index('ix_answers_question_id_is_correct', 'question_id', 'is_correct'),)
     
     answer_id = db.Column(db.Integer, primary_key=True)
     question_id = db.Column(db.Integer, db.ForeignKey('questions.question_id'), nullable=False)
@@ -58,11 +62,16 @@ class Answer(db.Model):
 
 class GameSession(db.Model):
     __tablename__ = 'game_sessions'
+    # Codes are handed out again once a game is over, so they only need to be unique among unfinished games
+    __table_args__ = (
+        db.Index('uq_game_sessions_unfinished_game_code', 'game_code', unique=True,
+                 sqlite_where=db.text("status != 'completed'"), postgresql_where=db.text("status != 'completed'")),
+    )
     
     game_session_id = db.Column(db.Integer, primary_key=True)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.quiz_id'), nullable=False)
-    game_code = db.Column(db.String(10), unique=True, nullable=False)
-    admin_id = db.Column(db.Integer, db.ForeignKey('admin.admin_id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.quiz_id'), nullable=False, index=True)
+    game_code = db.Column(db.String(10), nullable=False)
+    admin_id = db.Column(db.Integer, db.ForeignKey('admin.admin_id'), nullable=False, index=True)
     status = db.Column(db.String(20), default='waiting')  # waiting, active, completed
     started_at = db.Column(db.DateTime)
     ended_at = db.Column(db.DateTime)
@@ -70,8 +79,40 @@ class GameSession(db.Model):
     # Relationships
     participants = db.relationship('Participant', backref='game_session', lazy=True, cascade='all, delete-orphan')
 
+class GameCheckpoint(db.Model):
+    """Latest binary snapshot of a game being played, and the lease of the worker running it, see checkpoint.py"""
+    __tablename__ = 'game_checkpoints'
+    
+    game_session_id = db.Column(db.Integer, db.ForeignKey('game_sessions.game_session_id'), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)  # empty until the first checkpoint
+    saved_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    owner = db.Column(db.String(32))  # worker id
+    lease_expires_at = db.Column(db.DateTime)
+
+class GameCodeBlock(db.Model):
+    """A range of game code counter values reserved by one worker"""
+    __tablename__ = 'game_code_blocks'
+    
+    block_id = db.Column(db.Integer, primary_key=True)
+    reserved_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+class ImportJob(db.Model):
+    """Progress of a quiz import running in the background, readable from any worker"""
+    __tablename__ = 'import_jobs'
+    
+    job_id = db.Column(db.String(32), primary_key=True)
+    admin_id = db.Column(db.Integer, db.ForeignKey('admin.admin_id'), nullable=False)
+    status = db.Column(db.String(20), default='running')  # running, completed, failed
+    imported_count = db.Column(db.Integer, default=0)
+    question_count = db.Column(db.Integer, default=0)
+    warnings = db.Column(db.Text)  # JSON list of per-quiz errors
+    error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), index=True)
+
 class Participant(db.Model):
     __tablename__ = 'participants'
+    # Also serves lookups by game_session_id alone
+    __table_args__ = (db.Index('ix_participants_game_session_id_total_score', 'game_session_id', 'total_score'),)
     
     participant_id = db.Column(db.Integer, primary_key=True)
     game_session_id = db.Column(db.Integer, db.ForeignKey('game_sessions.game_session_id'), nullable=False)
@@ -84,11 +125,68 @@ class Participant(db.Model):
 
 class ParticipantAnswer(db.Model):
     __tablename__ = 'participant_answers'
+    # A participant picks each answer of a question at most once, so replayed submissions can't be saved twice
+    __table_args__ = (
+        db.Index('uq_participant_answers_participant_question_answer', 'participant_id', 'question_id', 'answer_id',
+                 unique=True),
+    )
     
     participant_answer_id = db.Column(db.Integer, primary_key=True)
-    participant_id = db.Column(db.Integer, db.ForeignKey('participants.participant_id'), nullable=False)
-    question_id = db.Column(db.Integer, db.ForeignKey('questions.question_id'), nullable=False)
-    answer_id = db.Column(db.Integer, db.ForeignKey('answers.answer_id'), nullable=False)
+    participant_id = db.Column(db.Integer, db.ForeignKey('participants.participant_id'), nullable=False, index=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.question_id'), nullable=False, index=True)
+    answer_id = db.Column(db.Integer, db.ForeignKey('answers.answer_id'), nullable=False, index=True)
     time_taken = db.Column(db.Integer)  # in seconds
     points_earned = db.Column(db.Integer, default=0)
-    answered_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
\ No newline at end of file
+    answered_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+def add_missing_columns(engine):
+    """Add nullable columns declared above that an existing table does not have yet"""
+    inspector = inspect(engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=engine.dialect)
+                with engine.begin() as connection:
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+
+def create_missing_indexes(engine):
+    """Add indexes declared above that an existing database does not have yet.
+
+    ``create_all`` only creates missing tables, so indexes added to a table
+    that already exists would otherwise never be built.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except IntegrityError:
+                # Existing rows break a unique index; the app still runs without it
+                print(f"Could not create unique index {index.name}: the table already holds duplicate rows")
+
+
+def game_codes_reusable(engine):
+    """False while the database still has the old unique constraint on every game code"""
+    unique_constraints = inspect(engine).get_unique_constraints('game_sessions')
+    return not any(constraint['column_names'] == ['game_code'] for constraint in unique_constraints)
+
+
+def configure_sqlite(engine):
+    """Pragmas for serving many clients from one SQLite file.
+
+    WAL lets readers carry on while a write is in progress, and the busy
+    timeout makes a second writer (another worker process) wait its turn
+    instead of failing with "database is locked".
+    """
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.close()
@@ -0,0 +1,42 @@
+"""
+Password hashing that does not block the event loop.
+
+Hashing is deliberately slow CPU work. Under eventlet it would freeze every
+greenlet on the worker, including live games, for the length of the hash, so
+it runs on eventlet's OS thread pool instead (the hash functions release the
+GIL). Only a bounded number of hashes may be queued at once; past that,
+callers get ``HashingBusy`` and the request is turned away rather than piling
+up behind a flood of logins.
+"""
+
+import threading
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    """Too many password hashes are already queued"""
+
+
+class PasswordHasher:
+    def __init__(self, async_mode, max_pending=8):
+        self.async_mode = async_mode
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            if self.async_mode == 'eventlet':
+                from eventlet import tpool
+                return tpool.execute(func, *args)
+            # Threaded servers already hash on a thread of their own
+            return func(*args)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password)
+
+    def check(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
@@ -0,0 +1,94 @@
+"""
+Compiled, read-only snapshots of quizzes.
+
+A snapshot holds a quiz with all of its questions and answers, sorted and
+already serialized to JSON. Snapshots are versioned by ``Quiz.updated_at``, so
+any code path that edits a quiz or its questions must bump that column (and
+may call ``invalidate`` to free the old copy straight away). Other workers
+notice the new version the next time they look the quiz up. Only the most
+recently used ``MAX_SNAPSHOTS`` quizzes are kept, so quizzes that are no
+longer played (or were deleted on another worker) don't stay in memory.
+"""
+
+import json
+from collections import OrderedDict
+
+from models import db, Question, Answer
+
+
+class QuizSnapshot:
+    __slots__ = ('quiz_id', 'version', 'data', 'json')
+
+    def __init__(self, quiz_id, version, data):
+        self.quiz_id = quiz_id
+        self.version = version
+        # Shared between requests, treat as read-only
+        self.data = data
+        self.json = json.dumps(data).encode('utf-8')
+
+    @property
+    def questions(self):
+        return self.data['questions']
+
+
+MAX_SNAPSHOTS = 256
+
+# quiz_id -> QuizSnapshot, least recently used first
+snapshots = OrderedDict()
+
+
+def compile_snapshot(quiz):
+    """Load a quiz's questions and answers in one query and freeze them"""
+    rows = db.session.query(
+        Question.question_id, Question.question_text, Question.question_order,
+        Question.time_limit, Question.points,
+        Answer.answer_id, Answer.answer_text, Answer.is_correct, Answer.answer_order
+    ).outerjoin(Answer, Answer.question_id == Question.question_id).filter(
+        Question.quiz_id == quiz.quiz_id
+    ).order_by(
+        Question.question_order, Question.question_id, Answer.answer_order, Answer.answer_id
+    ).all()
+
+    questions = []
+    current = None
+    for row in rows:
+        if current is None or current['question_id'] != row.question_id:
+            current = {
+                'question_id': row.question_id,
+                'question_text': row.question_text,
+                'question_order': row.question_order,
+                'time_limit': row.time_limit,
+                'points': row.points,
+                'answers': []
+            }
+            questions.append(current)
+        if row.answer_id is not None:
+            current['answers'].append({
+                'answer_id': row.answer_id,
+                'answer_text': row.answer_text,
+                'is_correct': row.is_correct,
+                'answer_order': row.answer_order
+            })
+
+    return QuizSnapshot(quiz.quiz_id, quiz.updated_at, {
+        'quiz_id': quiz.quiz_id,
+        'title': quiz.title,
+        'description': quiz.description,
+        'questions': questions
+    })
+
+
+def get_snapshot(quiz):
+    """Snapshot for an already loaded Quiz, compiling it if it changed"""
+    snapshot = snapshots.get(quiz.quiz_id)
+    if snapshot is None or snapshot.version != quiz.updated_at:
+        snapshot = compile_snapshot(quiz)
+        snapshots[quiz.quiz_id] = snapshot
+        while len(snapshots) > MAX_SNAPSHOTS:
+            snapshots.popitem(last=False)
+    snapshots.move_to_end(quiz.quiz_id)
+    return snapshot
+
+
+def invalidate(quiz_id):
+    snapshots.pop(quiz_id, None)
@@ -0,0 +1,414 @@
+"""
+Streaming quiz export and import.
+
+Exports read one ordered query through a server-side cursor and turn it into
+JSON or CSV text piece by piece, so memory use does not grow with the size of
+the question library.
+
+Imports parse the upload incrementally and write each quiz's questions in
+chunks: one multi-row INSERT ... RETURNING for the questions (a row at a time
+on SQLite, which cannot return the ids in order), one for their answers,
+then a commit. Progress of imports running in the background is kept in the
+import_jobs table, so a status poll can land on any worker.
+"""
+
+import csv
+from datetime import datetime, timedelta, timezone
+from itertools import groupby, islice
+import json
+import uuid
+
+from sqlalchemy import delete, insert, select, update
+
+from models import db, Quiz, Question, Answer, ImportJob
+
+# Rows fetched from the cursor at a time, and bytes buffered per response chunk
+EXPORT_YIELD_PER = 500
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Characters read from an upload at a time
+IMPORT_READ_SIZE = 64 * 1024
+
+
+def _export_rows(admin_id):
+    statement = select(
+        Quiz.quiz_id, Quiz.title, Quiz.description,
+        Question.question_id, Question.question_text, Question.question_order,
+        Question.time_limit, Question.points,
+        Answer.answer_id, Answer.answer_text, Answer.is_correct, Answer.answer_order
+    ).outerjoin(Question, Question.quiz_id == Quiz.quiz_id).outerjoin(
+        Answer, Answer.question_id == Question.question_id
+    ).where(Quiz.admin_id == admin_id).order_by(
+        Quiz.quiz_id, Question.question_order, Question.question_id, Answer.answer_order, Answer.answer_id
+    ).execution_options(yield_per=EXPORT_YIELD_PER)
+    return db.session.execute(statement)
+
+
+def _questions(rows):
+    """Yield one quiz's questions (without database ids) from its rows"""
+    for question_id, question_rows in groupby(rows, key=lambda row: row.question_id):
+        if question_id is None:
+            continue
+        question_rows = list(question_rows)
+        first = question_rows[0]
+        yield {
+            'question_text': first.question_text,
+            'question_order': first.question_order,
+            'time_limit': first.time_limit,
+            'points': first.points,
+            'answers': [{
+                'answer_text': row.answer_text,
+                'is_correct': row.is_correct,
+                'answer_order': row.answer_order
+            } for row in question_rows if row.answer_id is not None]
+        }
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def iter_quizzes(admin_id):
+    """Yield (quiz dict, question iterator) for each of an admin's quizzes.
+
+    Each question iterator must be consumed before moving on to the next quiz.
+    """
+    rows = _export_rows(admin_id)
+    for quiz_id, quiz_rows in groupby(rows, key=lambda row: row.quiz_id):
+        first = next(quiz_rows)
+        quiz = {'quiz_id': quiz_id, 'title': first.title, 'description': first.description}
+        yield quiz, _questions(_prepend(first, quiz_rows))
+
+
+def _indent(text, spaces):
+    return text.replace('\n', '\n' + ' ' * spaces)
+
+
+def export_json(admin_id):
+    """Same document as ``json.dumps(quizzes, indent=2)``, produced piece by piece"""
+    yield '['
+    quiz_count = 0
+    for quiz, questions in iter_quizzes(admin_id):
+        # The quiz's own fields, left open so its questions can follow
+        head = json.dumps(quiz, indent=2)[:-2]
+        yield (',' if quiz_count else '') + '\n  ' + _indent(head, 2) + ',\n    "questions": ['
+        question_count = 0
+        for question in questions:
+            yield (',' if question_count else '') + '\n      ' + _indent(json.dumps(question, indent=2), 6)
+            question_count += 1
+        yield ('\n    ]' if question_count else ']') + '\n  }'
+        quiz_count += 1
+    yield '\n]' if quiz_count else ']'
+
+
+class _Echo:
+    """File-like object that hands back whatever csv.writer writes to it"""
+
+    def write(self, value):
+        return value
+
+
+def export_csv(admin_id):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(['Quiz Title', 'Description', 'Question Order', 'Question Text', 'Time Limit (sec)', 'Points', 'Answer Text', 'Is Correct', 'Answer Order'])
+    for quiz, questions in iter_quizzes(admin_id):
+        for question in questions:
+            for i, answer in enumerate(question['answers']):
+                # Quiz and question columns are only filled in on a question's first row
+                if i == 0:
+                    lead = [
+                        quiz['title'], quiz['description'], question['question_order'],
+                        question['question_text'], question['time_limit'], question['points']
+                    ]
+                else:
+                    lead = [''] * 6
+                yield writer.writerow(lead + [
+                    answer['answer_text'],
+                    'Yes' if answer['is_correct'] else 'No',
+                    answer['answer_order']
+                ])
+
+
+def chunked(pieces, size=EXPORT_CHUNK_SIZE):
+    """Join small text pieces into roughly ``size``-byte encoded chunks"""
+    buffer = []
+    buffered = 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+class ImportFormatError(ValueError):
+    """The upload parsed, but is not shaped like exported quizzes"""
+
+
+def iter_json_quizzes(stream, read_size=IMPORT_READ_SIZE):
+    """Yield (quiz fields, questions) from a JSON upload.
+
+    A top-level list is decoded one quiz at a time, so only the quiz being
+    imported is held in memory. A single quiz object is decoded whole.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+
+    def read(size):
+        nonlocal buffer, eof
+        chunk = stream.read(size)
+        eof = not chunk
+        buffer += chunk
+
+    while not buffer.strip() and not eof:
+        read(read_size)
+    buffer = buffer.lstrip()
+
+    if not buffer.startswith('['):
+        while not eof:
+            read(read_size)
+        data = json.loads(buffer)
+        if not isinstance(data, dict) or 'title' not in data:
+            raise ImportFormatError('Invalid JSON format')
+        yield _json_quiz(data)
+        return
+
+    position = 1
+    expect_item = True
+    while True:
+        # Skip whitespace and separators, reading more as needed
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            read(read_size)
+        if position >= len(buffer):
+            raise json.JSONDecodeError('Unterminated array', buffer, position)
+        if buffer[position] == ']':
+            return
+        if not expect_item:
+            if buffer[position] != ',':
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, position)
+            position += 1
+            expect_item = True
+            continue
+
+        try:
+            data, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Read at least as much again, so a large quiz is re-scanned only a few times
+            read(max(read_size, len(buffer)))
+            continue
+        expect_item = False
+        buffer = buffer[position:]
+        position = 0
+        yield _json_quiz(data)
+
+
+def _json_quiz(data):
+    if not isinstance(data, dict):
+        return {'title': 'Unknown', 'error': 'Not a quiz object'}, iter(())
+    return {
+        'title': data.get('title', 'Imported Quiz'),
+        'description': data.get('description', '')
+    }, iter(data.get('questions', []))
+
+
+class _Rows:
+    """Row iterator that lets a reader put one row back"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.pushed = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pushed is not None:
+            row, self.pushed = self.pushed, None
+            return row
+        return next(self.rows)
+
+    def push(self, row):
+        self.pushed = row
+
+
+def _cell(row, column):
+    return (row.get(column) or '').strip()
+
+
+def iter_csv_quizzes(stream):
+    """Yield (quiz fields, questions) from a CSV upload in the export layout.
+
+    A quiz runs from a row with a new Quiz Title until the next one.
+    """
+    rows = _Rows(csv.DictReader(stream))
+    previous_title = None
+    for row in rows:
+        title = _cell(row, 'Quiz Title')
+        # Rows of a quiz whose import stopped early are skipped
+        if not title or title == previous_title:
+            continue
+        previous_title = title
+        rows.push(row)
+        yield {'title': title, 'description': _cell(row, 'Description')}, _csv_questions(rows, title)
+
+
+def _csv_questions(rows, title):
+    question = None
+    for row in rows:
+        # Skip empty rows
+        if not any(row.values()):
+            continue
+        row_title = _cell(row, 'Quiz Title')
+        if row_title and row_title != title:
+            rows.push(row)
+            break
+
+        question_text = _cell(row, 'Question Text')
+        if question_text:
+            if question is not None:
+                yield question
+            question = {
+                'question_text': question_text,
+                'question_order': int(row.get('Question Order') or 1),
+                'time_limit': int(row.get('Time Limit (sec)') or 30),
+                'points': int(row.get('Points') or 100),
+                'answers': []
+            }
+
+        answer_text = _cell(row, 'Answer Text')
+        if answer_text and question is not None:
+            question['answers'].append({
+                'answer_text': answer_text,
+                'is_correct': _cell(row, 'Is Correct').lower() in ['yes', 'true', '1'],
+                'answer_order': int(row.get('Answer Order') or 0)
+            })
+    if question is not None:
+        yield question
+
+
+def _insert_questions(quiz_id, questions):
+    """Insert a chunk of questions and all of their answers in two statements"""
+    question_rows = [{
+        'quiz_id': quiz_id,
+        'question_text': question.get('question_text', ''),
+        'question_order': question.get('question_order', 0),
+        'time_limit': question.get('time_limit', 30),
+        'points': question.get('points', 100)
+    } for question in questions]
+
+    question_ids = db.session.execute(
+        insert(Question).returning(Question.question_id, sort_by_parameter_order=True),
+        question_rows
+    ).scalars().all()
+
+    answer_rows = []
+    for question, question_id in zip(questions, question_ids):
+        for answer in question.get('answers', []):
+            answer_rows.append({
+                'question_id': question_id,
+                'answer_text': answer.get('answer_text', ''),
+                'is_correct': answer.get('is_correct', False),
+                'answer_order': answer.get('answer_order', 0)
+            })
+    if answer_rows:
+        db.session.execute(insert(Answer), answer_rows)
+
+
+def _discard_quiz(quiz_id):
+    """Remove the chunks already committed for a quiz that failed part way"""
+    question_ids = select(Question.question_id).where(Question.quiz_id == quiz_id)
+    db.session.execute(delete(Answer).where(Answer.question_id.in_(question_ids)))
+    db.session.execute(delete(Question).where(Question.quiz_id == quiz_id))
+    db.session.execute(delete(Quiz).where(Quiz.quiz_id == quiz_id))
+    db.session.commit()
+
+
+def import_quizzes(admin_id, quizzes, chunk_size, progress=None):
+    """Import (quiz fields, questions) pairs, committing every ``chunk_size`` questions.
+
+    A quiz that fails is removed again and reported in the returned errors.
+    ``progress(quizzes_done, questions_done)`` is called after every commit.
+    Returns (imported_count, errors).
+    """
+    imported_count = 0
+    question_count = 0
+    errors = []
+    for quiz_data, questions in quizzes:
+        quiz_id = None
+        try:
+            if 'error' in quiz_data:
+                raise ValueError(quiz_data['error'])
+            quiz_id = db.session.execute(insert(Quiz).values(
+                admin_id=admin_id,
+                title=quiz_data['title'],
+                description=quiz_data['description']
+            ).returning(Quiz.quiz_id)).scalar_one()
+
+            while True:
+                chunk = list(islice(questions, chunk_size))
+                if not chunk:
+                    break
+                _insert_questions(quiz_id, chunk)
+                db.session.commit()
+                question_count += len(chunk)
+                if progress:
+                    progress(imported_count, question_count)
+
+            db.session.commit()
+            imported_count += 1
+            if progress:
+                progress(imported_count, question_count)
+        except Exception as e:
+            db.session.rollback()
+            if quiz_id is not None:
+                _discard_quiz(quiz_id)
+            errors.append(f"Failed to import '{quiz_data.get('title', 'Unknown')}': {str(e)}")
+    return imported_count, errors
+
+
+def start_import_job(admin_id):
+    """Record a new background import, returning its job id"""
+    job_id = uuid.uuid4().hex
+    db.session.add(ImportJob(job_id=job_id, admin_id=admin_id))
+    db.session.commit()
+    return job_id
+
+
+def update_import_job(job_id, warnings=None, **values):
+    if warnings is not None:
+        values['warnings'] = json.dumps(warnings) if warnings else None
+    values['updated_at'] = datetime.now(timezone.utc)
+    db.session.execute(update(ImportJob).where(ImportJob.job_id == job_id).values(**values))
+    db.session.commit()
+
+
+def expire_import_jobs(max_age):
+    """Forget jobs not updated for ``max_age`` seconds: finished ones, or ones whose worker died"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+    db.session.execute(delete(ImportJob).where(ImportJob.updated_at < cutoff))
+    db.session.commit()
+
+
+def import_job_status(job):
+    data = {
+        'job_id': job.job_id,
+        'status': job.status,
+        'imported_count': job.imported_count,
+        'question_count': job.question_count
+    }
+    if job.warnings:
+        data['warnings'] = json.loads(job.warnings)
+    if job.error:
+        data['error'] = job.error
+    return data
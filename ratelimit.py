@@ -0,0 +1,127 @@
+"""
+Per-socket rate limits and per-worker admission control for Socket.IO.
+
+Every event a connection sends spends a token from that connection's bucket
+for the event. Buckets refill at a steady rate up to a burst size, so normal
+play never notices them while a misbehaving tab is cut off after its burst.
+Rejected events never reach their handler, and the client is told with a
+``server_busy`` event (at most once until its bucket refills).
+"""
+
+import time
+
+import metrics
+
+# Handled by Socket.IO itself rather than sent by the client at will
+UNLIMITED_EVENTS = ('connect', 'disconnect')
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated', 'notified')
+
+    def __init__(self, burst):
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.notified = False
+
+    def take(self, rate, burst):
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.notified = False
+        return True
+
+
+class RateLimiter:
+    """Token buckets per connection and event.
+
+    ``limits`` maps event names to (events per second, burst); every other
+    event gets ``default``.
+    """
+
+    def __init__(self, default=(10, 20), limits=None):
+        self.default = default
+        self.limits = limits or {}
+        # sid -> {event name: TokenBucket}
+        self.buckets = {}
+
+    def allow(self, sid, event_name):
+        rate, burst = self.limits.get(event_name, self.default)
+        buckets = self.buckets.setdefault(sid, {})
+        bucket = buckets.get(event_name)
+        if bucket is None:
+            bucket = buckets[event_name] = TokenBucket(burst)
+        return bucket.take(rate, burst)
+
+    def should_notify(self, sid, event_name):
+        """True the first time an event is rejected since the bucket last let one through"""
+        bucket = self.buckets[sid][event_name]
+        notify, bucket.notified = not bucket.notified, True
+        return notify
+
+    def retry_after(self, event_name):
+        rate, _ = self.limits.get(event_name, self.default)
+        return round(1 / rate, 2)
+
+    def forget(self, sid):
+        self.buckets.pop(sid, None)
+
+
+class Admission:
+    """Caps the connections and games a single worker takes on"""
+
+    def __init__(self, max_connections=5000, max_games=200):
+        self.max_connections = max_connections
+        self.max_games = max_games
+        self.connections = 0
+
+    def admit_connection(self):
+        if self.connections >= self.max_connections:
+            return False
+        self.connections += 1
+        return True
+
+    def release_connection(self):
+        self.connections = max(self.connections - 1, 0)
+
+    def admit_game(self, running_games):
+        return running_games < self.max_games
+
+
+def busy(event_name, reason, message, retry_after=None):
+    """Count a refused event and build the ``server_busy`` payload telling the client why"""
+    metrics.increment('quiz_socketio_rejected_total', event=event_name, reason=reason)
+    payload = {'event': event_name, 'reason': reason, 'message': message}
+    if retry_after is not None:
+        payload['retry_after'] = retry_after
+    return payload
+
+
+def _wrap_handler(socketio, limiter, event_name, handler):
+    # Socket.IO server handlers are called with the sid first
+    def limited(sid, *args):
+        if limiter.allow(sid, event_name):
+            return handler(sid, *args)
+        if limiter.should_notify(sid, event_name):
+            payload = busy(event_name, 'rate_limited', 'Too many requests, please slow down',
+                           limiter.retry_after(event_name))
+            socketio.emit('server_busy', payload, to=sid)
+        else:
+            metrics.increment('quiz_socketio_rejected_total', event=event_name, reason='rate_limited')
+        return None
+
+    return limited
+
+
+def limit_socketio(socketio, limiter):
+    """Put every registered Socket.IO event handler behind the rate limiter.
+
+    Call this after all ``@socketio.on`` handlers have been defined.
+    """
+    for namespace_handlers in socketio.server.handlers.values():
+        for event_name, handler in list(namespace_handlers.items()):
+            if event_name not in UNLIMITED_EVENTS:
+                namespace_handlers[event_name] = _wrap_handler(socketio, limiter, event_name, handler)
@@ -0,0 +1,79 @@
+"""
+Server-side question timer.
+
+The server, not the host's browser, decides when a question is open. Answers
+are stamped with the time they reach the server and held until the question
+closes, at which point the whole round is handed to ``on_close`` to be graded
+and written in one batch.
+"""
+
+import time
+
+
+class OpenQuestion:
+    __slots__ = ('question_id', 'time_limit', 'points', 'opened_at', 'submissions')
+
+    def __init__(self, question_id, time_limit, points):
+        self.question_id = question_id
+        self.time_limit = time_limit
+        self.points = points
+        self.opened_at = time.monotonic()
+        # participant_id -> (frozenset of answer_ids, seconds since open, sid)
+        self.submissions = {}
+
+
+class QuestionScheduler:
+    def __init__(self, socketio, app, on_close, grace=0.5):
+        self.socketio = socketio
+        self.app = app
+        self.on_close = on_close
+        # Extra time allowed for answers sent just before the deadline
+        self.grace = grace
+        self.open_questions = {}
+
+    def open(self, game_code, question_id, time_limit, points):
+        """Open a question, closing whatever question the game had open"""
+        self.close(game_code)
+        open_question = OpenQuestion(question_id, time_limit, points)
+        self.open_questions[game_code] = open_question
+        self.socketio.start_background_task(
+            self._close_after, game_code, open_question, time_limit + self.grace
+        )
+        return open_question
+
+    def resume(self, game_code, question_id, time_limit, points, elapsed, submissions):
+        """Reopen a question from a checkpoint, ``elapsed`` seconds after it first opened"""
+        open_question = OpenQuestion(question_id, time_limit, points)
+        open_question.opened_at -= elapsed
+        open_question.submissions.update(submissions)
+        self.open_questions[game_code] = open_question
+        self.socketio.start_background_task(
+            self._close_after, game_code, open_question, max(time_limit + self.grace - elapsed, 0)
+        )
+        return open_question
+
+    def submit(self, game_code, participant_id, question_id, answer_ids, sid):
+        """Record an answer, returning the seconds since the question opened.
+
+        Returns None when the question is not open, and the answer is ignored.
+        """
+        open_question = self.open_questions.get(game_code)
+        if open_question is None or open_question.question_id != question_id:
+            return None
+        elapsed = min(time.monotonic() - open_question.opened_at, open_question.time_limit)
+        open_question.submissions.setdefault(participant_id, (answer_ids, elapsed, sid))
+        return elapsed
+
+    def close(self, game_code):
+        """Close the game's open question (if any) and grade it"""
+        open_question = self.open_questions.pop(game_code, None)
+        if open_question is not None:
+            self.on_close(game_code, open_question)
+        return open_question
+
+    def _close_after(self, game_code, open_question, delay):
+        self.socketio.sleep(delay)
+        # The host may have skipped ahead or opened another question meanwhile
+        if self.open_questions.get(game_code) is open_question:
+            with self.app.app_context():
+                self.close(game_code)
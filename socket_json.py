@@ -0,0 +1,35 @@
+"""
+JSON module for Socket.IO packets that can reuse payloads encoded in advance.
+
+A room broadcast is encoded into one packet per emit. Payloads that go out
+unchanged many times (a question sent to every player of a game) can be
+wrapped in ``Encoded`` once, and packets carrying them copy the cached text
+instead of walking the dict again. Pass this module as ``json=`` to SocketIO.
+"""
+
+import json
+
+loads = json.loads
+
+
+class Encoded(dict):
+    """A payload dict together with its JSON text, encoded once.
+
+    Anything that serialises it some other way (message queues, test
+    clients) just sees an ordinary dict. Treat it as read-only, changes would
+    not reach the cached text.
+    """
+    __slots__ = ('json',)
+
+    def __init__(self, payload):
+        super().__init__(payload)
+        self.json = json.dumps(payload, separators=(',', ':'))
+
+
+def dumps(obj, **kwargs):
+    # Socket.IO event packets are encoded as [event name, *arguments]
+    if type(obj) is list and any(type(item) is Encoded for item in obj):
+        return '[' + ','.join(
+            item.json if type(item) is Encoded else json.dumps(item, **kwargs) for item in obj
+        ) + ']'
+    return json.dumps(obj, **kwargs)
@@ -0,0 +1,71 @@
+"""
+Coalesced answer counts for the host screen.
+"""
+
+
+class TallyAggregator:
+    """Counts answers per game and sends the host one update per interval.
+
+    However many players answer at once, the host room receives at most one
+    ``answer_tally`` event per ``interval`` seconds per game, carrying the
+    running totals for the current question.
+    """
+
+    def __init__(self, socketio, interval=0.2):
+        self.socketio = socketio
+        self.interval = interval
+        self.tallies = {}
+        self._dirty = set()
+        self._task = None
+
+    def reset(self, game_code, question_id):
+        """Start counting a new question from zero"""
+        self.tallies[game_code] = {
+            'question_id': question_id,
+            'answered': 0,
+            'correct': 0,
+            'total_time': 0,
+            'distribution': {}
+        }
+        self._dirty.add(game_code)
+        self._ensure_running()
+
+    def record(self, game_code, question_id, answer_ids, correct, time_taken):
+        tally = self.tallies.get(game_code)
+        if tally is None or tally['question_id'] != question_id:
+            self.reset(game_code, question_id)
+            tally = self.tallies[game_code]
+
+        tally['answered'] += 1
+        if correct:
+            tally['correct'] += 1
+        tally['total_time'] += time_taken or 0
+        for answer_id in answer_ids:
+            tally['distribution'][answer_id] = tally['distribution'].get(answer_id, 0) + 1
+        self._dirty.add(game_code)
+        self._ensure_running()
+
+    def forget(self, game_code):
+        self.tallies.pop(game_code, None)
+        self._dirty.discard(game_code)
+
+    def _ensure_running(self):
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            dirty, self._dirty = self._dirty, set()
+            for game_code in dirty:
+                tally = self.tallies.get(game_code)
+                if tally is None:
+                    continue
+                answered = tally['answered']
+                self.socketio.emit('answer_tally', {
+                    'question_id': tally['question_id'],
+                    'answered': answered,
+                    'correct': tally['correct'],
+                    'avg_time': round(tally['total_time'] / answered, 1) if answered else 0,
+                    'distribution': {str(k): v for k, v in tally['distribution'].items()}
+                }, room=f'host_{game_code}')
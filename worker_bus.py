@@ -0,0 +1,73 @@
+"""
+Messages between the worker processes of the app.
+
+A game is run by the one worker holding its lease, so workers that get an
+event for a game they don't run pass it on. Every worker also keeps its own
+copy of the players and scores of the games its players are connected to,
+so a change one worker makes (a player joining, a score going up) is
+published for the others to apply. The messages travel over the Socket.IO
+message queue the workers already share, as events sent to a room no client
+ever joins, and every worker (the sender included) runs the handler
+registered for them. Without a message queue there is only one
+worker and messages are handled right away.
+"""
+
+from socketio import PubSubManager
+
+# Room no socket joins; events sent to it are read by the workers themselves
+ROOM = '__workers__'
+
+
+class WorkerBus:
+    """Publishes messages to every worker and runs their handlers.
+
+    Handlers are registered with ``@bus.on(event)`` and called with the
+    message data in a background task, inside an app context.
+    """
+
+    def __init__(self, socketio, app):
+        self.socketio = socketio
+        self.app = app
+        self.handlers = {}
+        self.manager = socketio.server.manager
+        # False when there is no message queue, i.e. this is the only worker
+        self.shared = isinstance(self.manager, PubSubManager)
+        if self.shared:
+            # Messages from the queue (and our own) pass through here before reaching any room
+            handle_emit = self.manager._handle_emit
+
+            def intercept(message):
+                if message.get('room') == ROOM:
+                    self._dispatch(message['event'], message['data'])
+                else:
+                    handle_emit(message)
+            self.manager._handle_emit = intercept
+
+    def on(self, event):
+        def register(handler):
+            self.handlers[event] = handler
+            return handler
+        return register
+
+    def publish(self, event, data):
+        if not self.shared:
+            self._dispatch(event, data)
+            return
+        # The queue is normally started by the first client to connect
+        server = self.socketio.server
+        if not server.manager_initialized:
+            server.manager_initialized = True
+            self.manager.initialize()
+        self.manager.emit(event, data, namespace='/', room=ROOM)
+
+    def _dispatch(self, event, data):
+        handler = self.handlers.get(event)
+        if handler is not None:
+            self.socketio.start_background_task(self._call, handler, event, data)
+
+    def _call(self, handler, event, data):
+        with self.app.app_context():
+            try:
+                handler(data)
+            except Exception:
+                self.app.logger.exception('Worker message %s failed', event)
@@ -0,0 +1,233 @@
+"""
+Write-behind batching for hot socket handlers.
+
+Handlers hand their rows to a MicroBatcher instead of committing themselves.
+A single background task drains everything queued within a short interval and
+writes it in one transaction, then wakes the handlers so they can acknowledge
+the client. Nothing is acknowledged before it has been committed, so a crash
+can only lose events the client never got a reply for.
+"""
+
+from collections import Counter, defaultdict
+
+from sqlalchemy import case, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, GameSession, Participant, ParticipantAnswer
+
+
+class _Ticket:
+    """Lets a handler wait for the batch holding its item to be committed"""
+
+    def __init__(self, event):
+        self.event = event
+        self.error = None
+        self.result = None
+
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class MicroBatcher:
+    """Collects items from many handlers and writes them in one transaction.
+
+    ``write(items)`` may return a list with one result per item, which is
+    handed back to the handler that submitted it. ``after_commit(items,
+    results)`` runs in the background task once a batch is committed. If a
+    batch fails, its items are retried one at a time so a single bad item
+    only fails its own handler. With ``writer`` set, batches are handed to
+    that SingleWriter instead of being committed here.
+    """
+
+    def __init__(self, socketio, app, write, interval=0.05, max_batch=1000, after_commit=None, writer=None):
+        self.socketio = socketio
+        self.app = app
+        self.write = write
+        self.after_commit = after_commit
+        self.writer = writer
+        self.interval = interval
+        self.max_batch = max_batch
+        self._queue = None
+        self._flush_now = None
+        self._task = None
+
+    def _start(self):
+        eio = self.socketio.server.eio
+        self._queue = eio.create_queue()
+        self._empty = eio.get_queue_empty_exception()
+        self._flush_now = eio.create_event()
+        self._task = self.socketio.start_background_task(self._run)
+
+    def _enqueue(self, item):
+        if self._task is None:
+            self._start()
+        ticket = _Ticket(self.socketio.server.eio.create_event())
+        self._queue.put((item, ticket))
+        return ticket
+
+    def submit(self, item):
+        """Queue an item, block until it has been committed and return its result"""
+        return self._enqueue(item).wait()
+
+    def submit_many(self, items):
+        """Queue several items, write them straight away and wait for the commit.
+
+        Returns the exception each item failed with, or None for those that
+        were written, instead of raising.
+        """
+        if not items:
+            # Nothing to wait for, and the writer task may not have been started yet
+            return []
+        tickets = [self._enqueue(item) for item in items]
+        self._flush_now.set()
+        for ticket in tickets:
+            ticket.event.wait()
+        return [ticket.error for ticket in tickets]
+
+    def flush(self):
+        """Commit everything queued so far without waiting for the interval"""
+        ticket = self._enqueue(None)
+        self._flush_now.set()
+        ticket.wait()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Give other handlers a moment to add to the batch
+            self._flush_now.wait(self.interval)
+            self._flush_now.clear()
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except self._empty:
+                    break
+            self._commit(batch)
+
+    def _write(self, items):
+        if self.writer is not None:
+            return self.writer.call(self.write, items)
+        with self.app.app_context():
+            try:
+                results = self.write(items)
+                db.session.commit()
+                return results
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _commit(self, batch):
+        items = [item for item, _ in batch if item is not None]
+        results = [None] * len(items)
+        errors = [None] * len(items)
+        if items:
+            try:
+                results = self._write(items) or results
+            except Exception as e:
+                if len(items) == 1:
+                    self.app.logger.exception('Batched write failed')
+                    errors = [e]
+                else:
+                    # Find the item(s) at fault, writing each on its own
+                    for index, item in enumerate(items):
+                        try:
+                            results[index] = (self._write([item]) or [None])[0]
+                        except Exception as e:
+                            self.app.logger.exception('Batched write failed')
+                            errors[index] = e
+
+        written = [(item, result) for item, result, error in zip(items, results, errors) if error is None]
+        if written and self.after_commit is not None:
+            try:
+                self.after_commit([item for item, _ in written], [result for _, result in written])
+            except Exception:
+                self.app.logger.exception('After-commit hook failed')
+
+        outcomes = iter(zip(results, errors))
+        for item, ticket in batch:
+            if item is not None:
+                ticket.result, ticket.error = next(outcomes)
+            ticket.event.set()
+
+
+class SingleWriter(MicroBatcher):
+    """The one task in this process that writes to the database.
+
+    SQLite allows a single writer at a time, so instead of every handler
+    committing on its own, they hand their writes here as functions to call.
+    Calls queued together run in one transaction.
+    """
+
+    def __init__(self, socketio, app, interval=0.005, max_batch=1000):
+        super().__init__(socketio, app, self._call_all, interval=interval, max_batch=max_batch)
+
+    @staticmethod
+    def _call_all(calls):
+        return [function(*args, **kwargs) for function, args, kwargs in calls]
+
+    def call(self, function, *args, **kwargs):
+        """Run ``function`` in the writer's transaction, returning its result once committed"""
+        return self.submit((function, args, kwargs))
+
+
+def insert_ignoring_duplicates(model):
+    """INSERT that skips rows clashing with a unique index, where the database supports it"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+    return insert(model)
+
+
+def write_answers(items):
+    """Insert a batch of answers and apply their points in two statements.
+
+    Each item is a dict with ``rows`` (ParticipantAnswer column dicts),
+    ``participant_id`` and ``points``. Rows that are already saved are
+    skipped, and an item only scores if all of its rows were new, so a
+    replayed batch changes nothing.
+    """
+    rows = [row for item in items for row in item['rows']]
+    inserted = Counter()
+    if rows:
+        inserted.update(db.session.execute(
+            insert_ignoring_duplicates(ParticipantAnswer).returning(
+                ParticipantAnswer.participant_id, ParticipantAnswer.question_id
+            ),
+            rows
+        ).tuples())
+
+    points = defaultdict(int)
+    for item in items:
+        rows = item['rows']
+        if rows and inserted[(rows[0]['participant_id'], rows[0]['question_id'])] < len(rows):
+            continue
+        if item['points']:
+            points[item['participant_id']] += item['points']
+    if points:
+        db.session.execute(
+            update(Participant)
+            .where(Participant.participant_id.in_(points.keys()))
+            .values(total_score=Participant.total_score + case(points, value=Participant.participant_id, else_=0))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def write_participants(items):
+    """Insert a batch of joining players, returning their new participant ids.
+
+    Each item is a dict with ``game_code``, ``game_session_id`` and ``nickname``.
+    """
+    return db.session.execute(
+        insert(Participant).returning(Participant.participant_id, sort_by_parameter_order=True),
+        [{'game_session_id': item['game_session_id'], 'nickname': item['nickname']} for item in items]
+    ).scalars().all()
+
+
+def update_game_session(game_session_id, **values):
+    db.session.execute(
+        update(GameSession).where(GameSession.game_session_id == game_session_id).values(**values)
+    )